@@ -1,90 +1,1450 @@
 import os
 import re
+import sys
+import logging
 import csv
 import io
+import json
+import hashlib
+import tempfile
+import threading
+import time
+import socket
+import uuid
+import math
+import sqlite3
+import hmac
+import signal
 import requests
-from datetime import datetime
-import pandas as pd
-import PyPDF2
-import pdfplumber
+from array import array
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import date, datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from pyairtable import Api
 
+# pandas, PyPDF2 and pdfplumber are imported where they are used: runs that parse no
+# PDF (rollups only, a daemon waiting for triggers) start without loading them
+
+log = logging.getLogger("airtable_pdf_extractor")
+
+# Line classifier for parse_delivery_data_advanced
+# Patterns are compiled once; each line is checked against the cheap prefilters
+# (document keyword, then date token) before running the delivery patterns.
+LINE_NOISE = 0
+LINE_CLIENT = 1
+LINE_DELIVERY = 2
+
+CLIENT_HEADER_RE = re.compile(r'^(\d+)\s+(.+)$')
+PLAIN_DATE_RE = re.compile(r'\d{2}-\w{3}-\d{2}')
+DELIVERY_DATE_RE = re.compile(r'(\d{2}-\w{3}\.-?\d{2})')
+REMITO_RE = re.compile(r'Remito\d+')
+
+# Pattern 1: Standard format with Remito (acepta punto después del mes)
+REMITO_LINE_RE = re.compile(r'(\d{2}-\w{3}\.-?\d{2})\s+(\d+)\s+Remito(\d+)\s+(\d+)\s+(\d+)\s+([A-Z\s\-\.]+?)\s+([A-Z\s\-\(\)\.,"]+?)\s+(\d+)\s+(\d+)\s+(\d+\.?\d*)\s+(\d+\.?\d*)')
+# Pattern 2: Format with Orden de Retiro
+RETIRO_LINE_RE = re.compile(r'(\d{2}-\w{3}\.-?\d{2})\s+(\d+)\s+Orden de Retiro(\d+)\s+(\d+)\s+(\d+)\s+([A-Z\s\-\.]+?)\s+([A-Z\s\-\(\)\.,"]+?)\s+(\d+)\s+(\d+)\s+(\d+\.?\d*)\s+(\d+\.?\d*)')
+# Pattern 3: More flexible pattern (any text as chofer)
+FLEXIBLE_LINE_RE = re.compile(r'(\d{2}-\w{3}\.-?\d{2})\s+(\d+)\s+(?:Remito|Orden de Retiro)(\d+)\s+(\d+)\s+(\d+)\s+(.+?)\s+([A-Z\s\-\(\)\.,"]+?)\s+(\d+)\s+(\d+)\s+(\d+\.?\d*)\s+(\d+\.?\d*)')
+
+def is_delivery_candidate(line, has_remito=None, has_retiro=None):
+    """Cheap prefilter: a document keyword plus a date token"""
+    if has_remito is None:
+        has_remito = 'Remito' in line
+        has_retiro = 'Orden de Retiro' in line
+    return (has_remito or has_retiro) and DELIVERY_DATE_RE.search(line) is not None
+
+def classify_delivery_line(line):
+    """
+    Classify a stripped, non-empty line of a GruSIMPA report
+    Returns (LINE_CLIENT, (code, name)), (LINE_DELIVERY, groups) or (LINE_NOISE, None)
+    """
+    # Client headers: a short numeric code followed by a name, without a date
+    client_match = CLIENT_HEADER_RE.match(line)
+    if client_match and not PLAIN_DATE_RE.search(line):
+        potential_code = client_match.group(1)
+        potential_name = client_match.group(2).strip()
+        if len(potential_code) <= 6 and not potential_name.isdigit():
+            return LINE_CLIENT, (potential_code, potential_name)
+    
+    # Every delivery pattern needs a document keyword and a date token
+    has_remito = 'Remito' in line
+    has_retiro = 'Orden de Retiro' in line
+    if not is_delivery_candidate(line, has_remito, has_retiro):
+        return LINE_NOISE, None
+    
+    # Same precedence as trying the patterns in sequence
+    delivery_match = None
+    if has_remito:
+        delivery_match = REMITO_LINE_RE.search(line)
+    if delivery_match is None and has_retiro:
+        delivery_match = RETIRO_LINE_RE.search(line)
+    if delivery_match is None:
+        delivery_match = FLEXIBLE_LINE_RE.search(line)
+    if delivery_match is None:
+        return LINE_NOISE, None
+    return LINE_DELIVERY, delivery_match.groups()
+
+def page_has_delivery_lines(page_text):
+    """
+    Check the text of a page from a fast extraction engine
+    True when at least one line parses as a delivery and every line with a delivery
+    date token does, so a garbled keyword or column cannot drop a record
+    """
+    found = False
+    for line in page_text.split('\n'):
+        line = line.strip()
+        if not line or not DELIVERY_DATE_RE.search(line):
+            continue
+        if classify_delivery_line(line)[0] != LINE_DELIVERY:
+            return False
+        found = True
+    return found
+
+# CSV headers of the extraction output, in column order
+CSV_FIELDNAMES = [
+    'Fecha', 'Viaje_Nr', 'Chofer', 'TransacNr', 'Remito',
+    'Cliente_Codigo', 'Cliente_Nombre', 'Localidad_Entrega',
+    'Codigo_Destino', 'Bultos', 'Cantidad', 'Peso_Neto', 'Peso_Bruto'
+]
+
+class InternedColumn:
+    """Text column that stores each distinct value once and an index per row"""
+    def __init__(self, values=(), codes=()):
+        self.values = list(values)
+        self.index = {value: code for code, value in enumerate(self.values)}
+        self.codes = array('I', codes)
+    
+    def extend(self, values):
+        index = self.index
+        for value in dict.fromkeys(values):  # distinct values, in order of appearance
+            if value not in index:
+                index[value] = len(self.values)
+                self.values.append(value)
+        self.codes.extend(map(index.__getitem__, values))
+    
+    def fill(self, rows, value):
+        """Set the first rows of the column to value"""
+        if value not in self.index:
+            self.index[value] = len(self.values)
+            self.values.append(value)
+        self.codes[:rows] = array('I', [self.index[value]]) * rows
+    
+    def __len__(self):
+        return len(self.codes)
+    
+    def __iter__(self):
+        return map(self.values.__getitem__, self.codes)
+
+class DeliveryBatch:
+    """
+    Columnar batch of delivery records
+    Quantities and weights are typed arrays, repeated text (dates, trips, chofer,
+    localidad, cliente, bultos) is interned and only remito/transac_nr are kept per row.
+    Bultos keeps the report's text (e.g. '007') so the CSV is written as it was read;
+    to_dataframe and to_arrow give it as a nullable integer.
+    Appended rows are buffered as tuples and moved into the columns a block at a time.
+    Iterating yields the records as dicts.
+    """
+    BLOCK_ROWS = 1024
+    
+    COLUMNS = [
+        'fecha', 'transac_nr', 'remito', 'viaje_nr', 'chofer_code', 'chofer',
+        'localidad_entrega', 'cliente_codigo', 'cliente_nombre', 'codigo_destino',
+        'bultos', 'cantidad', 'peso_neto', 'peso_bruto'
+    ]
+    TEXT_COLUMNS = ['transac_nr', 'remito']
+    INTERNED_COLUMNS = [
+        'fecha', 'viaje_nr', 'chofer_code', 'chofer', 'localidad_entrega',
+        'cliente_codigo', 'cliente_nombre', 'codigo_destino', 'bultos'
+    ]
+    ARRAY_COLUMNS = {'cantidad': 'd', 'peso_neto': 'd', 'peso_bruto': 'd'}
+    
+    def __init__(self):
+        self.columns = {}
+        for name in self.TEXT_COLUMNS:
+            self.columns[name] = []
+        for name in self.INTERNED_COLUMNS:
+            self.columns[name] = InternedColumn()
+        for name, typecode in self.ARRAY_COLUMNS.items():
+            self.columns[name] = array(typecode)
+        self._pending = []
+    
+    def _add_row(self, row):
+        pending = self._pending
+        pending.append(row)
+        if len(pending) >= self.BLOCK_ROWS:
+            self._flush()
+    
+    def _flush(self):
+        """Move the buffered rows into the columns"""
+        if not self._pending:
+            return
+        for name, values in zip(self.COLUMNS, zip(*self._pending)):
+            self.columns[name].extend(values)
+        self._pending = []
+    
+    def append(self, *values):
+        """Append one record given its values in COLUMNS order"""
+        self._add_row(values)
+    
+    def append_delivery(self, groups, client_code, client_name):
+        """Append the record of a delivery line from its pattern groups"""
+        self._add_row((
+            groups[0], groups[1], groups[2], groups[3], groups[4],
+            groups[5].strip(), groups[6].strip(),
+            client_code or '', client_name or '',
+            '',  # codigo_destino: not clearly visible in this format
+            groups[7], float(groups[8]), float(groups[9]), float(groups[10])
+        ))
+    
+    def append_record(self, record):
+        """Append a record given as a dict"""
+        bultos = record.get('bultos', '0')
+        self.append(
+            record.get('fecha', ''), record.get('transac_nr', ''), record.get('remito', ''),
+            record.get('viaje_nr', ''), record.get('chofer_code', ''), record.get('chofer', ''),
+            record.get('localidad_entrega', ''), record.get('cliente_codigo', ''),
+            record.get('cliente_nombre', ''), record.get('codigo_destino', ''),
+            '' if bultos is None else str(bultos), float(record.get('cantidad', 0.0)),
+            float(record.get('peso_neto', 0.0)), float(record.get('peso_bruto', 0.0))
+        )
+    
+    @classmethod
+    def from_records(cls, records):
+        batch = cls()
+        for record in records:
+            batch.append_record(record)
+        return batch
+    
+    @classmethod
+    def from_csv(cls, csv_text):
+        """Read back the CSV written by write_csv; None if the text has other columns"""
+        reader = csv.reader(io.StringIO(csv_text))
+        if next(reader, None) != CSV_FIELDNAMES:
+            return None
+        batch = cls()
+        for row in reader:
+            if len(row) != len(CSV_FIELDNAMES):
+                continue
+            (fecha, viaje_nr, chofer, transac_nr, remito, cliente_codigo, cliente_nombre,
+             localidad_entrega, codigo_destino, bultos, cantidad, peso_neto, peso_bruto) = row
+            batch.append(fecha, transac_nr, remito, viaje_nr, '', chofer, localidad_entrega,
+                         cliente_codigo, cliente_nombre, codigo_destino,
+                         bultos, float(cantidad or 0), float(peso_neto or 0), float(peso_bruto or 0))
+        return batch
+    
+    def extend(self, other):
+        """Append all the records of another batch"""
+        self._flush()
+        other._flush()
+        for name in self.COLUMNS:
+            self.columns[name].extend(other.columns[name])
+    
+    def keys(self):
+        """(remito, transac_nr) of each record, in order"""
+        self._flush()
+        return list(zip(self.columns['remito'], self.columns['transac_nr']))
+    
+    def set_client(self, rows, client_code, client_name):
+        """Assign a client to the first rows (parsed before any client header)"""
+        self._flush()
+        self.columns['cliente_codigo'].fill(rows, client_code or '')
+        self.columns['cliente_nombre'].fill(rows, client_name or '')
+    
+    def __len__(self):
+        return len(self.columns['remito']) + len(self._pending)
+    
+    def __iter__(self):
+        self._flush()
+        for values in zip(*(self.columns[name] for name in self.COLUMNS)):
+            yield dict(zip(self.COLUMNS, values))
+    
+    def write_csv(self, output):
+        """Write the header and all rows to a text file with a single writerows call"""
+        self._flush()
+        c = self.columns
+        writer = csv.writer(output)
+        writer.writerow(CSV_FIELDNAMES)
+        writer.writerows(zip(
+            c['fecha'], c['viaje_nr'], c['chofer'], c['transac_nr'], c['remito'],
+            c['cliente_codigo'], c['cliente_nombre'], c['localidad_entrega'],
+            c['codigo_destino'], c['bultos'], c['cantidad'], c['peso_neto'], c['peso_bruto']
+        ))
+    
+    def _bultos_numbers(self):
+        """Bultos of each row as an int, or None when the text is not a number"""
+        column = self.columns['bultos']
+        numbers = [int(value) if value.strip().isdigit() else None for value in column.values]  # once per value
+        return map(numbers.__getitem__, column.codes)
+    
+    def to_dataframe(self):
+        """
+        DataFrame with numeric columns for the arrays and categoricals for interned text
+        (bultos as a nullable Int64)
+        """
+        import pandas as pd
+        self._flush()
+        data = {}
+        for name in self.COLUMNS:
+            column = self.columns[name]
+            if name == 'bultos':
+                data[name] = pd.Series(list(self._bultos_numbers()), dtype='Int64')
+            elif name in self.ARRAY_COLUMNS:
+                data[name] = pd.Series(column.tolist(), dtype='float64')
+            elif name in self.INTERNED_COLUMNS:
+                data[name] = pd.Categorical.from_codes(column.codes.tolist(), categories=column.values)
+            else:
+                data[name] = column
+        return pd.DataFrame(data, columns=self.COLUMNS)
+    
+    def to_arrow(self):
+        """
+        pyarrow Table with typed columns: fecha as a date (fecha_texto keeps the report's
+        text), bultos as int64 (null when not a number), float64 arrays and
+        dictionary-encoded interned text
+        """
+        import pyarrow as pa
+        self._flush()
+        fechas = self.columns['fecha']
+        dates = [parse_report_date(value) for value in fechas.values]  # once per distinct fecha
+        data = {'fecha': pa.array(map(dates.__getitem__, fechas.codes), pa.date32(), size=len(fechas))}
+        for name in self.COLUMNS:
+            column = self.columns[name]
+            if name == 'bultos':
+                data[name] = pa.array(self._bultos_numbers(), pa.int64(), size=len(column))
+            elif name in self.ARRAY_COLUMNS:
+                data[name] = pa.array(column, pa.float64())
+            elif name in self.INTERNED_COLUMNS:
+                data['fecha_texto' if name == 'fecha' else name] = pa.DictionaryArray.from_arrays(
+                    pa.array(column.codes, pa.int32()), pa.array(column.values, pa.string()))
+            else:
+                data[name] = pa.array(column, pa.string())
+        return pa.table(data)
+    
+    def to_json(self):
+        """Columnar JSON form used by the extraction cache"""
+        self._flush()
+        data = {}
+        for name in self.COLUMNS:
+            column = self.columns[name]
+            if name in self.INTERNED_COLUMNS:
+                data[name] = {'values': column.values, 'codes': column.codes.tolist()}
+            elif name in self.ARRAY_COLUMNS:
+                data[name] = column.tolist()
+            else:
+                data[name] = column
+        return json.dumps(data, ensure_ascii=False)
+    
+    @classmethod
+    def from_json(cls, text):
+        data = json.loads(text)
+        batch = cls()
+        for name in cls.TEXT_COLUMNS:
+            batch.columns[name] = data[name]
+        for name in cls.INTERNED_COLUMNS:
+            batch.columns[name] = InternedColumn(data[name]['values'], data[name]['codes'])
+        for name, typecode in cls.ARRAY_COLUMNS.items():
+            batch.columns[name] = array(typecode, data[name])
+        return batch
+
+# Month abbreviations of the report dates (DD-Mmm.-YY)
+REPORT_MONTHS = {
+    'ene': 1, 'feb': 2, 'mar': 3, 'abr': 4, 'may': 5, 'jun': 6,
+    'jul': 7, 'ago': 8, 'sep': 9, 'set': 9, 'oct': 10, 'nov': 11, 'dic': 12
+}
+REPORT_DATE_RE = re.compile(r'(\d{2})-(\w{3})\.?-?(\d{2})$')
+
+def parse_report_date(fecha):
+    """Date of a report fecha such as '09-Sep.-25', or None if it cannot be read"""
+    match = REPORT_DATE_RE.match(fecha.strip())
+    if not match:
+        return None
+    month = REPORT_MONTHS.get(match.group(2).lower())
+    if month is None:
+        return None
+    try:
+        return date(2000 + int(match.group(3)), month, int(match.group(1)))
+    except ValueError:
+        return None
+
+def client_totals(batch):
+    """
+    Per-client totals of one document's DeliveryBatch, for ClientRollups
+    Like the clients dashboard, only deliveries with a client name and a positive
+    peso_neto are counted.
+    """
+    df = batch.to_dataframe()
+    df = df[(df['cliente_nombre'] != '') & (df['peso_neto'] > 0)]
+    totals = {}
+    for nombre, rows in df.groupby('cliente_nombre', observed=True, sort=False):
+        fechas = [parse_report_date(fecha) for fecha in rows['fecha'].unique()]
+        fechas = [fecha for fecha in fechas if fecha is not None]
+        totals[nombre] = {
+            'kg': round(float(rows['peso_neto'].sum()), 2),
+            'viajes': int(rows['viaje_nr'].nunique()),
+            'entregas': len(rows),
+            'fecha_ultima': max(fechas).isoformat() if fechas else None,
+            'localidades': [str(localidad) for localidad in rows['localidad_entrega'].unique() if localidad]
+        }
+    return totals
+
+class RunMetrics:
+    """
+    Thread-safe counters and timings of a run, grouped by stage
+    Names are 'stage.counter' (e.g. 'download.bytes'); timings are accumulated in
+    milliseconds under 'stage.ms'. Worker processes send theirs back with take().
+    """
+    def __init__(self):
+        self.counters = {}
+        self.lock = threading.Lock()
+    
+    def incr(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+    
+    def add_time(self, stage, seconds):
+        self.incr(f"{stage}.ms", seconds * 1000)
+    
+    def merge(self, counters):
+        with self.lock:
+            for name, value in counters.items():
+                self.counters[name] = self.counters.get(name, 0) + value
+    
+    def take(self):
+        """Return and reset the counters"""
+        with self.lock:
+            counters, self.counters = self.counters, {}
+        return counters
+    
+    def get(self, name, default=0):
+        with self.lock:
+            return self.counters.get(name, default)
+    
+    def to_dict(self):
+        """Counters nested by stage, timings rounded to milliseconds"""
+        with self.lock:
+            counters = dict(self.counters)
+        stages = {}
+        for name, value in sorted(counters.items()):
+            stage, _, counter = name.partition('.')
+            stages.setdefault(stage, {})[counter] = round(value, 1) if isinstance(value, float) else value
+        return stages
+
+class PdfplumberEngine:
+    """Layout-aware text extraction with pdfplumber (slowest, most faithful)"""
+    name = 'pdfplumber'
+    
+    def load(self):
+        import pdfplumber
+        return pdfplumber
+    
+    def open(self, pdf_content):
+        return self.load().open(io.BytesIO(pdf_content))
+    
+    def page_count(self, document):
+        return len(document.pages)
+    
+    def extract_page(self, document, index):
+        page = document.pages[index]
+        page_text = page.extract_text()
+        page.close()  # Liberar la cache de layout de la página
+        return page_text
+    
+    def close(self, document):
+        document.close()
+
+class PyPDF2Engine:
+    """Fast text extraction with PyPDF2, without layout analysis"""
+    name = 'pypdf2'
+    
+    def load(self):
+        import PyPDF2
+        return PyPDF2
+    
+    def open(self, pdf_content):
+        return self.load().PdfReader(io.BytesIO(pdf_content))
+    
+    def page_count(self, document):
+        return len(document.pages)
+    
+    def extract_page(self, document, index):
+        return document.pages[index].extract_text()
+    
+    def close(self, document):
+        pass
+
+def default_text_engines(name='fast'):
+    """Engines for ImprovedPDFExtractor: 'fast' (PyPDF2 with pdfplumber fallback) or 'pdfplumber'"""
+    if name == 'pdfplumber':
+        return [PdfplumberEngine()]
+    return [PyPDF2Engine(), PdfplumberEngine()]
+
+class AirtableWriteBuffer:
+    """
+    Write-behind buffer for Airtable record updates
+    Updates are queued and sent through batch_update in chunks of batch_size records
+    (Airtable accepts at most 10 per request). Failed chunks are retried with
+    exponential backoff; call flush() or close() before exiting.
+    on_written(chunk) is called after each chunk is confirmed by Airtable.
+    """
+    def __init__(self, table, batch_size=10, max_retries=3, retry_delay=1.0, on_written=None, metrics=None):
+        self.table = table
+        self.on_written = on_written
+        self.metrics = metrics if metrics is not None else RunMetrics()
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.pending = {}
+        self.failed = []
+        self.lock = threading.Lock()
+    
+    def update(self, record_id, fields):
+        """Queue an update; later updates of the same record are merged"""
+        with self.lock:
+            if record_id in self.pending:
+                self.pending[record_id].update(fields)
+            else:
+                self.pending[record_id] = dict(fields)
+            chunk = self._take(self.batch_size) if len(self.pending) >= self.batch_size else None
+        if chunk:
+            self._send(chunk)
+    
+    def flush(self):
+        """Send every queued update"""
+        while True:
+            with self.lock:
+                chunk = self._take(self.batch_size)
+            if not chunk:
+                break
+            self._send(chunk)
+    
+    def close(self):
+        self.flush()
+        if self.failed:
+            log.error(f"❌ {len(self.failed)} actualizaciones no se pudieron escribir en Airtable")
+    
+    def _take(self, count):
+        record_ids = list(self.pending)[:count]
+        return [{'id': record_id, 'fields': self.pending.pop(record_id)} for record_id in record_ids]
+    
+    def _send(self, chunk):
+        for attempt in range(self.max_retries + 1):
+            try:
+                self.metrics.incr('airtable.batch_calls')
+                started = time.perf_counter()
+                self.table.batch_update(chunk)
+                self.metrics.add_time('airtable', time.perf_counter() - started)
+                self.metrics.incr('airtable.updates', len(chunk))
+                if self.on_written is not None:
+                    self.on_written(chunk)
+                return
+            except Exception as e:
+                if attempt < self.max_retries:
+                    self.metrics.incr('airtable.retries')
+                    delay = self.retry_delay * (2 ** attempt)
+                    log.warning(f"⚠️ Error en batch_update ({e}), reintentando en {delay:.1f}s...")
+                    time.sleep(delay)
+                else:
+                    log.error(f"❌ Error en batch_update tras {self.max_retries} reintentos: {e}")
+                    self.metrics.incr('airtable.failed_updates', len(chunk))
+                    with self.lock:
+                        self.failed.extend(chunk)
+
+# Bump when parse_delivery_data_advanced / parse_simple_table_data change their output,
+# so cached records are re-parsed from the cached text
+PARSER_VERSION = "2"
+
+# Extracted text and CSV output stay in memory up to this size, then spill to disk
+SPOOL_MAX_BYTES = 8 * 1024 * 1024
+
+class AttachmentDownloader:
+    """
+    Attachment downloads over a shared keep-alive connection pool
+    Bodies are streamed in chunks and joined once at the end (the PDF engines and the
+    worker processes need the whole content as bytes), every request has connect/read
+    timeouts, and connection errors, timeouts, 429 and 5xx responses
+    are retried with exponential backoff (capped at max_retry_delay). A 403/410 means
+    the signed attachment URL expired: the URL is refreshed once through the refresh
+    callback and the download starts again.
+    """
+    RETRY_STATUS = {429, 500, 502, 503, 504}
+    EXPIRED_STATUS = {403, 410}
+    
+    def __init__(self, pool_size=10, connect_timeout=5.0, read_timeout=60.0, max_retries=3, retry_delay=1.0,
+                 max_retry_delay=30.0, chunk_size=64 * 1024, metrics=None, session=None):
+        self.session = session if session is not None else requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.chunk_size = chunk_size
+        self.metrics = metrics if metrics is not None else RunMetrics()
+    
+    def download(self, url, refresh=None):
+        """
+        Download an attachment and return its content, or None if it failed
+        refresh: optional callable returning a new URL for the same attachment
+        """
+        started = time.perf_counter()
+        attempt = 0
+        refreshed = False
+        try:
+            while True:
+                try:
+                    content = self._fetch(url)
+                except requests.HTTPError as e:
+                    status = e.response.status_code
+                    if status in self.EXPIRED_STATUS and refresh is not None and not refreshed:
+                        refreshed = True
+                        self.metrics.incr('download.url_refreshes')
+                        log.info(f"🔑 URL del adjunto vencida ({status}), pidiendo una nueva a Airtable")
+                        url = refresh()
+                        if not url:
+                            raise
+                        continue
+                    if status not in self.RETRY_STATUS or attempt >= self.max_retries:
+                        raise
+                    error = e
+                except (requests.ConnectionError, requests.Timeout) as e:
+                    if isinstance(e, requests.Timeout):
+                        self.metrics.incr('download.timeouts')
+                    if attempt >= self.max_retries:
+                        raise
+                    error = e
+                else:
+                    elapsed = time.perf_counter() - started
+                    self.metrics.incr('download.count')
+                    self.metrics.incr('download.bytes', len(content))
+                    log.debug(f"⬇️ Descargados {len(content)} bytes en {elapsed * 1000:.0f} ms")
+                    return content
+                
+                delay = min(self.retry_delay * (2 ** attempt), self.max_retry_delay)
+                attempt += 1
+                self.metrics.incr('download.retries')
+                log.warning(f"⚠️ Error descargando PDF ({error}), reintento {attempt}/{self.max_retries} "
+                            f"en {delay:.1f}s...")
+                time.sleep(delay)
+        except requests.RequestException as e:
+            log.error(f"Error downloading PDF: {e}")
+            self.metrics.incr('download.errors')
+            return None
+        finally:
+            self.metrics.add_time('download', time.perf_counter() - started)
+    
+    def _fetch(self, url):
+        with self.session.get(url, stream=True, timeout=self.timeout) as response:
+            response.raise_for_status()
+            return b"".join(response.iter_content(self.chunk_size))
+    
+    def close(self):
+        self.session.close()
+
+class PDFExtractionCache:
+    """
+    On-disk cache of PDF extractions keyed by the SHA-256 of the PDF bytes
+    The extracted text is stored once per PDF and the parsed DeliveryBatch per PARSER_VERSION,
+    so a parser change only re-runs the regex stage. Files are evicted least recently
+    used first once the cache grows beyond max_bytes; the size is measured on disk,
+    since pipeline worker processes write to the same directory.
+    """
+    def __init__(self, cache_dir, max_bytes=500 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.text_hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        self.total_bytes = sum(size for _, size, _ in self._files())
+    
+    def key_for(self, pdf_content, variant=None):
+        digest = hashlib.sha256(pdf_content).hexdigest()
+        return f"{digest}.{variant}" if variant else digest
+    
+    def _text_path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.txt")
+    
+    def _records_path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.v{PARSER_VERSION}.json")
+    
+    def _touch(self, path):
+        """Mark a cache file as recently used; False if it does not exist"""
+        try:
+            os.utime(path)
+            return True
+        except OSError:
+            return False
+    
+    def lookup(self, key):
+        """
+        Check what is cached for a PDF hash and count the hit or miss
+        Returns 'hit' (text and records for the current parser version),
+        'text' (only the extracted text) or 'miss'
+        """
+        has_text = self._touch(self._text_path(key))
+        has_records = has_text and self._touch(self._records_path(key))
+        with self.lock:
+            if has_records:
+                self.hits += 1
+                return 'hit'
+            if has_text:
+                self.text_hits += 1
+                return 'text'
+            self.misses += 1
+            return 'miss'
+    
+    def open_text(self, key):
+        return open(self._text_path(key), 'r', encoding='utf-8', newline='\n')
+    
+    def load_batch(self, key):
+        """Load the cached DeliveryBatch of a PDF"""
+        with open(self._records_path(key), 'r', encoding='utf-8') as f:
+            return DeliveryBatch.from_json(f.read())
+    
+    def writer(self, key, write_text=True):
+        """Start a new cache entry; the text is only written when write_text is set"""
+        return PDFCacheEntry(self, key, write_text)
+    
+    def _files(self):
+        """(mtime, size, path) of the committed cache files; entries being written are left out"""
+        files = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith('.tmp'):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+        return files
+    
+    def evict(self):
+        """Delete least recently used files until the cache fits in max_bytes"""
+        with self.lock:
+            entries = sorted(self._files())
+            self.total_bytes = sum(size for _, size, _ in entries)
+            for _, size, path in entries:
+                if self.total_bytes <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                    self.total_bytes -= size
+                except OSError:
+                    pass
+    
+    def summary(self):
+        with self.lock:
+            self.total_bytes = sum(size for _, size, _ in self._files())
+        return (f"💾 Cache: {self.hits} hits, {self.text_hits} re-parseados desde texto, "
+                f"{self.misses} misses ({self.total_bytes / (1024 * 1024):.1f} MB)")
+
+class PDFCacheEntry:
+    """
+    Cache entry being written while a PDF is streamed
+    Text and records go to temporary files that only replace the cached ones on commit()
+    """
+    def __init__(self, cache, key, write_text):
+        self.cache = cache
+        self.paths = []
+        self.text = self._open(cache._text_path(key), 'w+', newline='\n') if write_text else None
+        self.records = self._open(cache._records_path(key), 'w')
+    
+    def _open(self, path, mode, newline=None):
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        self.paths.append((tmp_path, path))
+        return open(tmp_path, mode, encoding='utf-8', newline=newline)
+    
+    def write_batch(self, batch):
+        self.records.write(batch.to_json())
+    
+    def _close(self):
+        for f in (self.text, self.records):
+            if f is not None:
+                f.close()
+    
+    def commit(self):
+        try:
+            self._close()
+            for tmp_path, path in self.paths:
+                os.replace(tmp_path, path)
+            self.cache.evict()
+        except OSError as e:
+            log.warning(f"⚠️ No se pudo guardar en cache: {e}")
+            self.discard()
+    
+    def discard(self):
+        self._close()
+        for tmp_path, _ in self.paths:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+class SyncCheckpoint:
+    """
+    Local checkpoint of the records finished by an incremental run
+    A record is marked once its Airtable update is confirmed, together with the id of
+    the attachment that was processed. A crashed or timed-out run resumes by skipping
+    marked records; the checkpoint is cleared when a run completes.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.records = {}
+        if os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    self.records = json.load(f).get('records', {})
+                log.info(f"📌 Reanudando desde checkpoint: {len(self.records)} registros ya procesados")
+            except (OSError, ValueError) as e:
+                log.warning(f"⚠️ Checkpoint ilegible, se ignora: {e}")
+    
+    def is_done(self, record_id, attachment_id):
+        with self.lock:
+            entry = self.records.get(record_id)
+        return entry is not None and entry['attachment_id'] == attachment_id
+    
+    def mark(self, record_id, attachment_id):
+        with self.lock:
+            self.records[record_id] = {
+                'attachment_id': attachment_id,
+                'processed_at': datetime.now().isoformat(timespec='seconds')
+            }
+    
+    def save(self):
+        with self.lock:
+            content = json.dumps({'records': self.records})
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(content)
+        os.replace(tmp_path, self.path)
+    
+    def clear(self):
+        with self.lock:
+            self.records = {}
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+def record_shard(record_id, shard_count):
+    """Shard (0..shard_count-1) a record id belongs to; stable across runs and machines"""
+    return int(hashlib.sha1(record_id.encode('utf-8')).hexdigest()[:8], 16) % shard_count
+
+class RecordLeases:
+    """
+    Record claiming through a lease written to a dedicated text field
+    For a chunk of records, workers re-read the current status and lease, skip the
+    records that are 'Procesado' or leased by another live worker, write
+    "<expiry> (<owner>)" to the lease field of the rest, wait settle_seconds and read
+    them back: those still holding their owner are theirs. Airtable has no conditional
+    updates, so the read-back is what resolves two workers claiming at once (the last
+    write wins). The status field is never touched, so it can stay a single select. A
+    lease that expired (crashed worker) can be claimed again; the final update clears it.
+    Failed Airtable calls are retried with exponential backoff; a chunk that still fails
+    is left unclaimed (a lease already written on it expires) and the run goes on.
+    """
+    LEASE_RE = re.compile(r'^(\S+) \((.+)\)$')
+    
+    def __init__(self, table, status_field_name, lease_field_name, owner, lease_seconds=900, settle_seconds=1.0,
+                 metrics=None, max_retries=3, retry_delay=1.0):
+        self.table = table
+        self.status_field_name = status_field_name
+        self.lease_field_name = lease_field_name
+        self.owner = owner
+        self.lease_seconds = lease_seconds
+        self.settle_seconds = settle_seconds
+        self.metrics = metrics if metrics is not None else RunMetrics()
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+    
+    @classmethod
+    def parse(cls, lease):
+        """(expiry, owner) of a lease field value, or None if it holds no lease"""
+        match = cls.LEASE_RE.match(lease or '')
+        if not match:
+            return None
+        try:
+            return datetime.fromisoformat(match.group(1)), match.group(2)
+        except ValueError:
+            return None
+    
+    def held_elsewhere(self, lease):
+        """True if a lease field value is a lease of another worker that has not expired"""
+        lease = self.parse(lease)
+        return lease is not None and lease[1] != self.owner and lease[0] > datetime.now(timezone.utc)
+    
+    def _retrying(self, call, *args, **kwargs):
+        """Make an Airtable call, retrying failures with exponential backoff"""
+        for attempt in range(self.max_retries + 1):
+            try:
+                return call(*args, **kwargs)
+            except Exception as e:
+                if attempt == self.max_retries:
+                    raise
+                self.metrics.incr('airtable.retries')
+                delay = self.retry_delay * (2 ** attempt)
+                log.warning(f"⚠️ Error al reservar registros ({e}), reintentando en {delay:.1f}s...")
+                time.sleep(delay)
+    
+    def _current(self, records):
+        """(status, lease) of each record, read back from Airtable"""
+        formula = "OR(" + ", ".join(f"RECORD_ID() = '{record['id']}'" for record in records) + ")"
+        self.metrics.incr('airtable.fetch_calls')
+        found = self._retrying(self.table.all, formula=formula, fields=[self.status_field_name, self.lease_field_name])
+        return {record['id']: (record['fields'].get(self.status_field_name), record['fields'].get(self.lease_field_name))
+                for record in found}
+    
+    def claim(self, records):
+        """Write leases on records and return the ones this worker holds afterwards"""
+        if not records:
+            return []
+        started = time.perf_counter()
+        try:
+            return self._claim(records)
+        except Exception as e:
+            log.error(f"❌ No se pudieron reservar {len(records)} registros tras {self.max_retries} reintentos, "
+                      f"se omiten en esta ejecución: {e}")
+            self.metrics.incr('lease.failed_chunks')
+            self.metrics.incr('lease.failed', len(records))
+            return []
+        finally:
+            self.metrics.add_time('airtable', time.perf_counter() - started)
+    
+    def _claim(self, records):
+        current = self._current(records)
+        free = [record for record in records
+                if current.get(record['id'], (None, None))[0] != 'Procesado'
+                and not self.held_elsewhere(current.get(record['id'], (None, None))[1])]
+        self.metrics.incr('lease.held_elsewhere', len(records) - len(free))
+        if not free:
+            return []
+        
+        expiry = datetime.now(timezone.utc) + timedelta(seconds=self.lease_seconds)
+        lease = f"{expiry.isoformat(timespec='seconds')} ({self.owner})"
+        self.metrics.incr('airtable.batch_calls')
+        self._retrying(self.table.batch_update, [{'id': record['id'], 'fields': {self.lease_field_name: lease}}
+                                                 for record in free])
+        time.sleep(self.settle_seconds)
+        current = self._current(free)
+        
+        records = free
+        claimed = [record for record in records if current.get(record['id'], (None, None))[1] == lease]
+        self.metrics.incr('lease.claimed', len(claimed))
+        self.metrics.incr('lease.lost', len(records) - len(claimed))
+        return claimed
+
+# Dashboard segments by kg_total: (name, minimum kg), largest first. The dashboard reads
+# them from the Segmento column; its CSV fallback (analyze-clients) repeats these thresholds
+CLIENT_SEGMENTS = [('grande', 12000), ('mediana', 7000), ('chica', 1000)]
+
+# Overlap when fetching the CSV changed since a watermark, for clock skew with Airtable
+STORED_DOCUMENTS_MARGIN = timedelta(minutes=10)
+
+class ClientRollups:
+    """
+    Per-client totals (kg, viajes, documentos, última fecha, localidades) kept up to date
+    as documents are processed, so the dashboard does not re-aggregate every CSV
+    The totals of each document are stored by record id: reprocessing a document replaces
+    its previous contribution, and only the clients it touches are recomputed. Clients
+    changed since the last summary table sync are kept in 'pending' until they are synced.
+    synced_at is the start of the last pass over the stored CSV (see sync_stored_documents).
+    """
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.documents = {}
+        self.clients = {}
+        self.pending = set()
+        self.synced_at = None
+        if os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                self.documents = data.get('documents', {})
+                self.clients = data.get('clients', {})
+                self.pending = set(data.get('pending', []))
+                self.synced_at = data.get('synced_at')
+            except (OSError, ValueError) as e:
+                log.warning(f"⚠️ Totales por cliente ilegibles, se recalculan desde cero: {e}")
+        self.client_documents = {}
+        for record_id, document in self.documents.items():
+            for client in document['clientes']:
+                self.client_documents.setdefault(client, set()).add(record_id)
+    
+    def update_document(self, record_id, filename, totals):
+        """Set the per-client totals of a document (from client_totals) and recompute its clients"""
+        with self.lock:
+            previous = self.documents.get(record_id)
+            affected = set(totals)
+            if previous is not None:
+                affected.update(previous['clientes'])
+                for client in previous['clientes']:
+                    self.client_documents[client].discard(record_id)
+            self.documents[record_id] = {'documento': filename, 'clientes': totals}
+            for client in totals:
+                self.client_documents.setdefault(client, set()).add(record_id)
+            for client in affected:
+                self._recompute(client)
+            self.pending.update(affected)
+    
+    def _recompute(self, client):
+        record_ids = sorted(self.client_documents.get(client, ()))
+        if not record_ids:
+            self.client_documents.pop(client, None)
+            self.clients.pop(client, None)
+            return
+        parts = [self.documents[record_id] for record_id in record_ids]
+        totals = [part['clientes'][client] for part in parts]
+        fechas = [total['fecha_ultima'] for total in totals if total['fecha_ultima']]
+        kg_total = round(sum(total['kg'] for total in totals), 2)
+        self.clients[client] = {
+            'kg_total': kg_total,
+            'viajes': sum(total['viajes'] for total in totals),
+            'entregas': sum(total['entregas'] for total in totals),
+            'documentos': len(parts),
+            'documentos_info': [part['documento'] for part in parts],
+            'fecha_ultima': max(fechas) if fechas else None,
+            'localidades': list(dict.fromkeys(localidad for total in totals for localidad in total['localidades'])),
+            'segmento': next((name for name, minimum in CLIENT_SEGMENTS if kg_total >= minimum), None)
+        }
+    
+    def take_pending(self):
+        """Clients changed since the last sync, with their totals (None if they no longer have any)"""
+        with self.lock:
+            pending = {client: self.clients.get(client) for client in sorted(self.pending)}
+            self.pending = set()
+        return pending
+    
+    def restore_pending(self, clients):
+        """Keep clients for the next sync after a failed one"""
+        with self.lock:
+            self.pending.update(clients)
+    
+    def save(self):
+        with self.lock:
+            content = json.dumps({'documents': self.documents, 'clients': self.clients,
+                                  'pending': sorted(self.pending), 'synced_at': self.synced_at}, ensure_ascii=False)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(content)
+        os.replace(tmp_path, self.path)
+
+def client_summary_fields(client, totals):
+    """Fields of a client's row in the Airtable summary table"""
+    totals = totals or {}
+    return {
+        'Cliente_Nombre': client,
+        'Localidad': ", ".join(totals.get('localidades', [])),
+        'Kg_Total': totals.get('kg_total', 0),
+        'Viajes': totals.get('viajes', 0),
+        'Entregas': totals.get('entregas', 0),
+        'Documentos': totals.get('documentos', 0),
+        'Documentos_Info': "\n".join(totals.get('documentos_info', [])),
+        'Fecha_Ultima': totals.get('fecha_ultima'),
+        'Segmento': totals.get('segmento')
+    }
+
+class BloomFilter:
+    """
+    Fixed-size Bloom filter over strings: no false negatives, and about error_rate
+    false positives while it holds at most capacity items
+    """
+    def __init__(self, capacity, error_rate=0.001, bits=None, count=0):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray(bits) if bits is not None else bytearray((self.size + 7) // 8)
+        self.count = count
+    
+    def _positions(self, item):
+        digest = hashlib.blake2b(item.encode('utf-8'), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        step = int.from_bytes(digest[8:], 'little') | 1
+        return ((first + i * step) % self.size for i in range(self.hash_count))
+    
+    def add(self, item):
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+    
+    def __contains__(self, item):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+class DeliveryIndex:
+    """
+    Persistent index of the deliveries already seen, keyed by (remito, transac_nr)
+    Each key stores the record and document that first contained it, in an SQLite
+    table on disk. A Bloom filter in front of it answers most lookups for new deliveries
+    without touching the disk; it is saved with the table and rebuilt from it when it
+    is missing, out of date (e.g. after a crash), over capacity or was saved with other
+    parameters. synced_at is the start
+    of the last pass over the stored CSV (see sync_stored_documents).
+    """
+    def __init__(self, path, capacity=1_000_000, error_rate=0.001):
+        self.path = path
+        self.error_rate = error_rate
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("CREATE TABLE IF NOT EXISTS deliveries (remito TEXT, transac_nr TEXT, record_id TEXT, "
+                        "documento TEXT, PRIMARY KEY (remito, transac_nr)) WITHOUT ROWID")
+        self.db.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value)")
+        self.db.commit()
+        self.synced_at = dict(self.db.execute("SELECT name, value FROM meta")).get('synced_at')
+        self.bloom = self._load_bloom(capacity)
+    
+    def __len__(self):
+        return self.db.execute("SELECT COUNT(*) FROM deliveries").fetchone()[0]
+    
+    @staticmethod
+    def _bloom_key(remito, transac_nr):
+        return f"{remito}\x1f{transac_nr}"
+    
+    def _load_bloom(self, capacity):
+        """
+        The saved Bloom filter if it covers every stored key and was built with the same
+        parameters (error_rate, bit size and hash count), otherwise a rebuilt one
+        """
+        stored = len(self)
+        meta = dict(self.db.execute("SELECT name, value FROM meta"))
+        if meta.get('bloom_count') == stored and meta.get('bloom_capacity', 0) >= stored:
+            bloom = BloomFilter(meta['bloom_capacity'], self.error_rate, meta['bloom_bits'], stored)
+            if (meta.get('bloom_error_rate') == self.error_rate and meta.get('bloom_size') == bloom.size
+                    and meta.get('bloom_hash_count') == bloom.hash_count
+                    and len(bloom.bits) == (bloom.size + 7) // 8):
+                return bloom
+        return self._rebuild_bloom(max(capacity, 2 * stored))
+    
+    def _rebuild_bloom(self, capacity):
+        if self.db.execute("SELECT 1 FROM deliveries LIMIT 1").fetchone() is not None:
+            log.info(f"🔁 Reconstruyendo el filtro del índice de entregas ({capacity} claves)")
+        bloom = BloomFilter(capacity, self.error_rate)
+        for remito, transac_nr in self.db.execute("SELECT remito, transac_nr FROM deliveries"):
+            bloom.add(self._bloom_key(remito, transac_nr))
+        return bloom
+    
+    def check(self, record_id, filename, keys, metrics=None):
+        """
+        Record the (remito, transac_nr) keys of a document and return its duplicates
+        A key is a duplicate when another record saw it first, or when it repeats
+        within the document. Reprocessing a document does not report its own keys.
+        Returns a list of (remito, transac_nr, first_record_id, first_documento).
+        """
+        duplicates = []
+        new_keys = []
+        seen = set()
+        lookups = 0
+        with self.lock:
+            for key in keys:
+                if not key[0]:
+                    continue  # records from the simple parser have no remito
+                if key in seen:
+                    duplicates.append((*key, record_id, filename))
+                    continue
+                seen.add(key)
+                if self._bloom_key(*key) in self.bloom:
+                    lookups += 1
+                    first = self.db.execute("SELECT record_id, documento FROM deliveries "
+                                            "WHERE remito = ? AND transac_nr = ?", key).fetchone()
+                    if first is not None:
+                        if first[0] != record_id:
+                            duplicates.append((*key, *first))
+                        continue
+                new_keys.append(key)
+            
+            if new_keys:
+                self.db.executemany("INSERT OR IGNORE INTO deliveries VALUES (?, ?, ?, ?)",
+                                    [(*key, record_id, filename) for key in new_keys])
+                self.db.commit()
+                for key in new_keys:
+                    self.bloom.add(self._bloom_key(*key))
+                if self.bloom.count > self.bloom.capacity:
+                    self.bloom = self._rebuild_bloom(2 * self.bloom.count)
+        
+        if metrics is not None:
+            metrics.incr('dedup.keys', len(seen))
+            metrics.incr('dedup.new', len(new_keys))
+            metrics.incr('dedup.duplicates', len(duplicates))
+            metrics.incr('dedup.disk_lookups', lookups)
+        return duplicates
+    
+    def save(self):
+        """Store the Bloom filter next to the keys it covers"""
+        with self.lock:
+            self.db.executemany("INSERT OR REPLACE INTO meta VALUES (?, ?)", [
+                ('bloom_capacity', self.bloom.capacity), ('bloom_count', self.bloom.count),
+                ('bloom_error_rate', self.bloom.error_rate), ('bloom_size', self.bloom.size),
+                ('bloom_hash_count', self.bloom.hash_count), ('bloom_bits', bytes(self.bloom.bits)),
+                ('synced_at', self.synced_at)])
+            self.db.commit()
+
+class ParquetDeliverySink:
+    """
+    Local Parquet dataset with the records of every processed document
+    Files are partitioned by month of fecha (<root>/mes=2025-09/<record_id>.parquet, and
+    mes=sin_fecha when the date cannot be read), one per document and month, with the
+    typed columns of DeliveryBatch.to_arrow plus record_id and documento. Writing a
+    document again replaces all of its files, so reprocessing never duplicates rows.
+    Read it with e.g. pandas.read_parquet(root). Requires pyarrow.
+    """
+    UNKNOWN_MONTH = 'sin_fecha'
+    
+    def __init__(self, root, compression='zstd'):
+        import pyarrow.parquet  # Fail at startup if pyarrow is missing
+        self.root = root
+        self.compression = compression
+        os.makedirs(root, exist_ok=True)
+    
+    def document_files(self, record_id):
+        """Current files of a document, by partition directory"""
+        files = {}
+        for partition in os.listdir(self.root):
+            path = os.path.join(self.root, partition, f"{record_id}.parquet")
+            if partition.startswith('mes=') and os.path.exists(path):
+                files[partition] = path
+        return files
+    
+    def write_document(self, record_id, filename, batch):
+        """Replace the rows of a document with the records of batch; returns the files written"""
+        import pyarrow as pa
+        import pyarrow.compute as pc
+        import pyarrow.parquet as pq
+        
+        stale = self.document_files(record_id)
+        written = 0
+        if batch:
+            table = batch.to_arrow()
+            table = table.append_column('record_id', pa.array([record_id] * len(table), pa.string()))
+            table = table.append_column('documento', pa.array([filename] * len(table), pa.string()))
+            months = pc.fill_null(pc.strftime(table['fecha'], format='%Y-%m'), self.UNKNOWN_MONTH)
+            for month in pc.unique(months).to_pylist():
+                partition = f"mes={month}"
+                os.makedirs(os.path.join(self.root, partition), exist_ok=True)
+                path = os.path.join(self.root, partition, f"{record_id}.parquet")
+                tmp_path = f"{path}.tmp"
+                pq.write_table(table.filter(pc.equal(months, month)), tmp_path, compression=self.compression)
+                os.replace(tmp_path, path)
+                stale.pop(partition, None)
+                written += 1
+        for path in stale.values():
+            os.remove(path)
+        return written
+
 class ImprovedPDFExtractor:
-    def __init__(self, api_key, base_id, table_name):
+    def __init__(self, api_key, base_id, table_name, cache=None, checkpoint=None, engines=None, summary_path=None,
+                 rollups=None, summary_table_name=None, downloader=None, shard_index=0, shard_count=1,
+                 lease_seconds=None, lease_field_name='Lease_Procesamiento', page_parallel_threshold=None,
+                 page_workers=None, delivery_index=None, parquet_sink=None):
         """
         Initialize the improved PDF extractor with pattern recognition
+        cache: optional PDFExtractionCache to reuse extractions of already seen PDFs
+        checkpoint: optional SyncCheckpoint used to resume interrupted runs
+        engines: text extraction engines tried in order for each page; the last one is
+        the fallback (default: PyPDF2, then pdfplumber)
+        summary_path: optional file where the JSON summary of each run is written
+        rollups: optional ClientRollups updated with the clients of each processed document
+        summary_table_name: optional Airtable table where the changed client rollups are
+        upserted at the end of each run (matched on Cliente_Nombre)
+        downloader: AttachmentDownloader used for the PDFs (default settings if not given)
+        shard_index, shard_count: only process the records whose record_shard is shard_index
+        lease_seconds: claim records with a lease of this duration before processing them
+        (None: no leases)
+        lease_field_name: text field where the leases are written
+        page_parallel_threshold: PDFs with at least this many pages are split into page
+        ranges extracted and parsed in parallel processes (None: always sequential)
+        page_workers: number of page ranges and processes used for them (defaults to the
+        CPU count)
+        delivery_index: optional DeliveryIndex recording the (remito, transac_nr) of each
+        document, to report deliveries already seen in other documents
+        parquet_sink: optional ParquetDeliverySink where the records of each document are
+        exported
         """
+        self.api_key = api_key
         self.api = Api(api_key)
         self.base_id = base_id
         self.table_name = table_name
         self.table = self.api.table(base_id, table_name)
+        self.write_buffer = None
+        self.cache = cache
+        self.checkpoint = checkpoint
+        self.attachment_ids = {}
+        self.engines = engines if engines is not None else default_text_engines()
+        self.metrics = RunMetrics()
+        self.summary_path = summary_path
+        self.run_started = None
+        self.rollups = rollups
+        self.summary_table = self.api.table(base_id, summary_table_name) if summary_table_name else None
+        self.pending_rollups = None
+        self.downloader = downloader if downloader is not None else AttachmentDownloader()
+        self.downloader.metrics = self.metrics
+        self.shard_index = shard_index
+        self.shard_count = shard_count
+        self.lease_seconds = lease_seconds
+        self.lease_field_name = lease_field_name
+        self.leases_held = set()
+        self.failed_attachments = None  # (record_id, attachment_id) that failed, when kept (daemon)
+        self.worker_id = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self.page_parallel_threshold = page_parallel_threshold
+        self.page_workers = page_workers or os.cpu_count() or 1
+        self.page_pool = None
+        self._owns_page_pool = False
+        self.delivery_index = delivery_index
+        self.duplicates = {}
+        self.stored_documents_summary = None
+        self.cpu_pool = None
+        self.cpu_pool_workers = None
+        self.parquet_sink = parquet_sink
     
-    def download_pdf_from_url(self, pdf_url):
-        """Download PDF content from Airtable attachment URL"""
-        try:
-            response = requests.get(pdf_url)
-            response.raise_for_status()
-            return response.content
-        except requests.RequestException as e:
-            print(f"Error downloading PDF: {e}")
-            return None
+    def download_pdf_from_url(self, pdf_url, refresh=None):
+        """
+        Download PDF content from Airtable attachment URL
+        refresh: optional callable returning a new URL when the signed one expired
+        """
+        return self.downloader.download(pdf_url, refresh)
     
-    def extract_text_from_pdf(self, pdf_content):
-        """Extract all text from PDF using pdfplumber"""
+    def _attachment_url_refresher(self, record, pdf_field_name):
+        """Callable that re-fetches a record to get a new signed URL for its first attachment"""
+        record_id = record['id']
+        attachment_id = record['fields'][pdf_field_name][0].get('id')
+        
+        def refresh():
+            try:
+                self.metrics.incr('airtable.fetch_calls')
+                record = self.table.get(record_id)
+            except Exception as e:
+                log.error(f"❌ No se pudo refrescar la URL del adjunto de {record_id}: {e}")
+                return None
+            attachments = record['fields'].get(pdf_field_name) or []
+            for attachment in attachments:
+                if attachment.get('id') == attachment_id:
+                    return attachment['url']
+            return attachments[0]['url'] if attachments else None
+        return refresh
+    
+    def iter_pdf_page_texts(self, pdf_content, stats=None, first_page=0, last_page=None):
+        """
+        Yield the text of each PDF page (or of pages first_page to last_page - 1)
+        Engines are tried in order for each page: a page's text is used when it passes
+        page_has_delivery_lines, otherwise the next engine extracts it again; the last
+        engine (pdfplumber) is always accepted. Documents are opened lazily and pdfplumber
+        releases each page's layout cache, so memory does not grow with the number of
+        pages. Pages per engine are counted in stats['engine_pages'] and extraction
+        errors are reported through stats['extraction_failed'].
+        """
+        if stats is None:
+            stats = {}
+        engine_pages = stats.setdefault('engine_pages', {})
+        documents = {}
+        
+        def document_for(engine):
+            if engine.name not in documents:
+                documents[engine.name] = engine.open(pdf_content)
+            return documents[engine.name]
+        
         try:
-            text_content = ""
-            pdf_file = io.BytesIO(pdf_content)
-            
-            with pdfplumber.open(pdf_file) as pdf:
-                print(f"📄 PDF tiene {len(pdf.pages)} páginas")
-                for i, page in enumerate(pdf.pages):
-                    page_text = page.extract_text()
-                    if page_text:
-                        print(f"📄 Página {i+1}: {len(page_text)} caracteres")
-                        text_content += page_text + "\n\n"
-                    else:
-                        print(f"⚠️ Página {i+1}: Sin texto extraído")
+            # The first engine that can open the PDF gives the page count
+            engines = list(self.engines)
+            while True:
+                try:
+                    page_count = engines[0].page_count(document_for(engines[0]))
+                    break
+                except Exception as e:
+                    if len(engines) == 1:
+                        raise
+                    log.warning(f"⚠️ {engines[0].name} no pudo abrir el PDF ({e}), usando {engines[1].name}")
+                    engines.pop(0)
             
-            print(f"📊 Total extraído: {len(text_content)} caracteres")
-            return text_content.strip()
+            if last_page is None:
+                log.info(f"📄 PDF tiene {page_count} páginas")
+                last_page = page_count
+            for i in range(first_page, min(last_page, page_count)):
+                started = time.perf_counter()
+                for position, engine in enumerate(engines):
+                    is_last = position == len(engines) - 1
+                    try:
+                        page_text = engine.extract_page(document_for(engine), i)
+                    except Exception:
+                        if is_last:
+                            raise
+                        continue
+                    if is_last or (page_text and page_has_delivery_lines(page_text)):
+                        break
+                self.metrics.add_time('extract', time.perf_counter() - started)
+                
+                engine_pages[engine.name] = engine_pages.get(engine.name, 0) + 1
+                if position > 0:
+                    stats['fallback_pages'] = stats.get('fallback_pages', 0) + 1
+                
+                if page_text:
+                    log.debug(f"📄 Página {i+1}: {len(page_text)} caracteres")
+                    yield page_text
+                else:
+                    log.debug(f"⚠️ Página {i+1}: Sin texto extraído")
         except Exception as e:
-            print(f"Error extracting text from PDF: {e}")
-            return ""
+            log.error(f"Error extracting text from PDF: {e}")
+            stats['extraction_failed'] = True
+        finally:
+            for engine in self.engines:
+                if engine.name in documents:
+                    engine.close(documents[engine.name])
+            self._record_engine_stats(stats)
     
-    def parse_delivery_data_advanced(self, text_content):
+    def _record_engine_stats(self, stats):
+        """Add the pages extracted by each engine to the run metrics"""
+        if not stats.get('engine_pages'):
+            return
+        summary = ", ".join(f"{name}: {count}" for name, count in stats['engine_pages'].items())
+        log.info(f"⚡ Páginas por motor: {summary} ({stats.get('fallback_pages', 0)} con fallback)")
+        for name, count in stats['engine_pages'].items():
+            self.metrics.incr('extract.pages', count)
+            self.metrics.incr(f'extract.pages_{name}', count)
+        self.metrics.incr('extract.fallback_pages', stats.get('fallback_pages', 0))
+    
+    def _cache_key(self, pdf_content):
+        """Cache key for a PDF; the extracted text depends on the engines used"""
+        return self.cache.key_for(pdf_content, "+".join(engine.name for engine in self.engines))
+    
+    def extract_text_from_pdf(self, pdf_content):
         """
-        Advanced parsing for GruSIMPA delivery documents
-        Handles multiple formats and patterns
+        Extract all text from PDF, page by page with self.engines (by default PyPDF2
+        first, falling back to pdfplumber for pages without recognizable delivery lines)
         """
-        delivery_records = []
-        lines = text_content.split('\n')
-        
-        print(f"🔍 Procesando {len(lines)} líneas de texto")
-        print("📋 Primeras 10 líneas del texto:")
-        for i, line in enumerate(lines[:10]):
-            print(f"  {i+1}: {line}")
+        stats = {}
+        text_content = "".join(page_text + "\n\n" for page_text in self.iter_pdf_page_texts(pdf_content, stats))
+        if stats.get('extraction_failed'):
+            return ""
         
+        log.info(f"📊 Total extraído: {len(text_content)} caracteres")
+        return text_content.strip()
+    
+    def iter_text_lines(self, text_chunks):
+        """Yield the lines of a sequence of text chunks (pages or file lines)"""
+        for chunk in text_chunks:
+            yield from chunk.split('\n')
+    
+    def parse_delivery_lines(self, lines, stats=None):
+        """
+        Parse report lines (any iterable, e.g. streamed pages) into a DeliveryBatch
+        The current client header carries over from one page to the next.
+        Line counters are accumulated in stats, along with the rows parsed before the
+        first client header ('rows_before_client') and the last client seen
+        ('last_client'), so parses of consecutive page ranges can be chained.
+        """
+        batch = DeliveryBatch()
         current_client_code = None
         current_client_name = None
-        
-        # Patterns for different line types
-        client_pattern = r'^(\d+)\s+(.+)$'
-        
-        # More flexible delivery record pattern
-        delivery_patterns = [
-            # Pattern 1: Standard format with Remito (CORREGIDO para aceptar punto después del mes)
-            r'(\d{2}-\w{3}\.-?\d{2})\s+(\d+)\s+Remito(\d+)\s+(\d+)\s+(\d+)\s+([A-Z\s\-\.]+?)\s+([A-Z\s\-\(\)\.,"]+?)\s+(\d+)\s+(\d+)\s+(\d+\.?\d*)\s+(\d+\.?\d*)',
-            
-            # Pattern 2: Format with Orden de Retiro (CORREGIDO)
-            r'(\d{2}-\w{3}\.-?\d{2})\s+(\d+)\s+Orden de Retiro(\d+)\s+(\d+)\s+(\d+)\s+([A-Z\s\-\.]+?)\s+([A-Z\s\-\(\)\.,"]+?)\s+(\d+)\s+(\d+)\s+(\d+\.?\d*)\s+(\d+\.?\d*)',
-            
-            # Pattern 3: More flexible pattern (CORREGIDO)
-            r'(\d{2}-\w{3}\.-?\d{2})\s+(\d+)\s+(?:Remito|Orden de Retiro)(\d+)\s+(\d+)\s+(\d+)\s+(.+?)\s+([A-Z\s\-\(\)\.,"]+?)\s+(\d+)\s+(\d+)\s+(\d+\.?\d*)\s+(\d+\.?\d*)'
-        ]
+        rows_before_client = None
         
         lines_processed = 0
         lines_matched = 0
         
+        # Checked once so per-line logging costs nothing when DEBUG is off
+        debug = log.isEnabledFor(logging.DEBUG)
+        
         for line in lines:
             line = line.strip()
             if not line:
@@ -92,82 +1452,68 @@ class ImprovedPDFExtractor:
             
             lines_processed += 1
             
-            # Check if line contains client information
-            client_match = re.match(client_pattern, line)
-            if client_match and not re.search(r'\d{2}-\w{3}-\d{2}', line):
-                potential_code = client_match.group(1)
-                potential_name = client_match.group(2).strip()
-                
-                # Validate that it looks like a client header
-                if len(potential_code) <= 6 and not potential_name.isdigit():
-                    current_client_code = potential_code
-                    current_client_name = potential_name
-                    print(f"👤 Cliente encontrado: {current_client_code} - {current_client_name}")
-                    continue
+            kind, value = classify_delivery_line(line)
             
-            # Try each delivery pattern
-            for pattern in delivery_patterns:
-                delivery_match = re.search(pattern, line)
-                if delivery_match:
-                    lines_matched += 1
-                    print(f"✅ Línea {lines_processed} coincide con patrón: {line[:50]}...")
-                    try:
-                        # Extract data based on the pattern
-                        groups = delivery_match.groups()
-                        
-                        # Validate that we have enough groups
-                        if len(groups) < 11:
-                            print(f"⚠️ Línea {lines_processed}: No hay suficientes grupos en el patrón. Grupos encontrados: {len(groups)}")
-                            continue
-                        
-                        record = {
-                            'fecha': groups[0] if len(groups) > 0 else '',
-                            'transac_nr': groups[1] if len(groups) > 1 else '',
-                            'remito': groups[2] if len(groups) > 2 else '',
-                            'viaje_nr': groups[3] if len(groups) > 3 else '',
-                            'chofer_code': groups[4] if len(groups) > 4 else '',
-                            'chofer': groups[5].strip() if len(groups) > 5 else '',
-                            'localidad_entrega': groups[6].strip() if len(groups) > 6 else '',
-                            'cliente_codigo': current_client_code or '',
-                            'cliente_nombre': current_client_name or '',
-                            'codigo_destino': '',  # Not clearly visible in this format
-                            'bultos': groups[7] if len(groups) > 7 else '0',
-                            'cantidad': float(groups[8]) if len(groups) > 8 else 0.0,
-                            'peso_neto': float(groups[9]) if len(groups) > 9 else 0.0,
-                            'peso_bruto': float(groups[10]) if len(groups) > 10 else 0.0
-                        }
-                        
-                        delivery_records.append(record)
-                        break  # Stop trying other patterns once we find a match
-                        
-                    except (ValueError, IndexError) as e:
-                        print(f"Error parsing line: {line[:50]}... - {e}")
-                        continue
-                else:
-                    # Debug: show why line doesn't match
-                    if lines_processed <= 20:  # Only show first 20 lines for debug
-                        print(f"❌ Línea {lines_processed} NO coincide: '{line}'")
-                        # Test each part of the pattern
-                        test_pattern = r'(\d{2}-\w{3}\.-?\d{2})'
-                        if re.search(test_pattern, line):
-                            print(f"   ✅ Fecha encontrada")
-                        else:
-                            print(f"   ❌ Fecha NO encontrada")
-                        
-                        test_pattern = r'Remito\d+'
-                        if re.search(test_pattern, line):
-                            print(f"   ✅ Remito encontrado")
-                        else:
-                            print(f"   ❌ Remito NO encontrado")
+            if kind == LINE_CLIENT:
+                if rows_before_client is None:
+                    rows_before_client = len(batch)
+                current_client_code, current_client_name = value
+                if debug:
+                    log.debug(f"👤 Cliente encontrado: {current_client_code} - {current_client_name}")
+                continue
+            
+            if kind == LINE_DELIVERY:
+                lines_matched += 1
+                if debug:
+                    log.debug(f"✅ Línea {lines_processed} coincide con patrón: {line[:50]}...")
+                try:
+                    batch.append_delivery(value, current_client_code, current_client_name)
+                except (ValueError, IndexError) as e:
+                    log.warning(f"Error parsing line: {line[:50]}... - {e}")
+                continue
+            
+            # Debug: show why line doesn't match
+            if debug and lines_processed <= 20:  # Only show first 20 lines for debug
+                log.debug(f"❌ Línea {lines_processed} NO coincide: '{line}'")
+                log.debug(f"   {'✅' if DELIVERY_DATE_RE.search(line) else '❌'} Fecha")
+                log.debug(f"   {'✅' if REMITO_RE.search(line) else '❌'} Remito")
         
-        print(f"📊 Resumen: {lines_processed} líneas procesadas, {lines_matched} líneas coincidieron")
+        if stats is not None:
+            stats['lines_processed'] = lines_processed
+            stats['lines_matched'] = lines_matched
+            if rows_before_client is None:
+                stats['rows_before_client'] = len(batch)
+                stats['last_client'] = None
+            else:
+                stats['rows_before_client'] = rows_before_client
+                stats['last_client'] = (current_client_code, current_client_name)
+        return batch
+    
+    def parse_delivery_data_advanced(self, text_content):
+        """
+        Advanced parsing for GruSIMPA delivery documents
+        Handles multiple formats and patterns, returns a DeliveryBatch
+        """
+        lines = text_content.split('\n')
+        
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug(f"🔍 Procesando {len(lines)} líneas de texto")
+            log.debug("📋 Primeras 10 líneas del texto:")
+            for i, line in enumerate(lines[:10]):
+                log.debug(f"  {i+1}: {line}")
+        
+        stats = {}
+        delivery_records = self.parse_delivery_lines(lines, stats)
+        
+        log.info(f"📊 Resumen: {stats['lines_processed']} líneas procesadas, {stats['lines_matched']} líneas coincidieron")
         return delivery_records
     
     def parse_simple_table_data(self, text_content):
         """
         Simple parsing that extracts data from table-like structures
+        Returns a DeliveryBatch
         """
-        delivery_records = []
+        delivery_records = DeliveryBatch()
         lines = text_content.split('\n')
         
         current_client_code = None
@@ -196,230 +1542,1178 @@ class ImprovedPDFExtractor:
                 if date_match:
                     try:
                         # Extract what we can from the line
-                        record = {
-                            'fecha': date_match.group(1),
-                            'transac_nr': '',
-                            'remito': '',
-                            'viaje_nr': '',
-                            'chofer_code': '',
-                            'chofer': '',
-                            'localidad_entrega': '',
-                            'cliente_codigo': current_client_code or '',
-                            'cliente_nombre': current_client_name or '',
-                            'codigo_destino': '',
-                            'bultos': '0',
-                            'cantidad': 0.0,
-                            'peso_neto': 0.0,
-                            'peso_bruto': 0.0
-                        }
+                        cantidad = peso_neto = peso_bruto = 0.0
+                        chofer = localidad_entrega = ''
                         
                         # Try to extract numbers from the line
                         numbers = re.findall(r'\d+\.?\d*', line)
                         if len(numbers) >= 3:
                             # Assume last few numbers are quantities/weights
-                            record['cantidad'] = float(numbers[-3]) if len(numbers) >= 3 else 0.0
-                            record['peso_neto'] = float(numbers[-2]) if len(numbers) >= 2 else 0.0
-                            record['peso_bruto'] = float(numbers[-1]) if len(numbers) >= 1 else 0.0
+                            cantidad = float(numbers[-3])
+                            peso_neto = float(numbers[-2])
+                            peso_bruto = float(numbers[-1])
                         
                         # Try to extract text parts (chofer, location)
                         text_parts = re.findall(r'[A-Z][A-Z\s\-\(\)\.,"]+', line)
                         if text_parts:
                             if len(text_parts) >= 2:
-                                record['chofer'] = text_parts[0].strip()
-                                record['localidad_entrega'] = text_parts[1].strip()
+                                chofer = text_parts[0].strip()
+                                localidad_entrega = text_parts[1].strip()
                             elif len(text_parts) == 1:
-                                record['localidad_entrega'] = text_parts[0].strip()
+                                localidad_entrega = text_parts[0].strip()
                         
-                        delivery_records.append(record)
+                        delivery_records.append(
+                            date_match.group(1), '', '', '', '', chofer, localidad_entrega,
+                            current_client_code or '', current_client_name or '', '',
+                            '0', cantidad, peso_neto, peso_bruto
+                        )
                         
                     except (ValueError, IndexError) as e:
-                        print(f"Error parsing simple line: {line[:50]}... - {e}")
+                        log.warning(f"Error parsing simple line: {line[:50]}... - {e}")
                         continue
         
         return delivery_records
     
+    def write_csv_rows(self, delivery_records, output):
+        """
+        Write delivery records (a DeliveryBatch or dicts) as CSV rows to a text file
+        Returns the number of records written
+        """
+        if not isinstance(delivery_records, DeliveryBatch):
+            delivery_records = DeliveryBatch.from_records(delivery_records)
+        delivery_records.write_csv(output)
+        return len(delivery_records)
+    
     def convert_to_csv_string(self, delivery_records):
         """Convert delivery records to CSV string format"""
         if not delivery_records:
             return "No se pudieron extraer registros estructurados del PDF"
         
-        # Create CSV string
         output = io.StringIO()
-        fieldnames = [
-            'Fecha', 'Viaje_Nr', 'Chofer', 'TransacNr', 'Remito',
-            'Cliente_Codigo', 'Cliente_Nombre', 'Localidad_Entrega',
-            'Codigo_Destino', 'Bultos', 'Cantidad', 'Peso_Neto', 'Peso_Bruto'
-        ]
-        
-        writer = csv.DictWriter(output, fieldnames=fieldnames)
-        writer.writeheader()
-        
-        for record in delivery_records:
-            # Map internal field names to CSV headers
-            csv_record = {
-                'Fecha': record.get('fecha', ''),
-                'Viaje_Nr': record.get('viaje_nr', ''),
-                'Chofer': record.get('chofer', ''),
-                'TransacNr': record.get('transac_nr', ''),
-                'Remito': record.get('remito', ''),
-                'Cliente_Codigo': record.get('cliente_codigo', ''),
-                'Cliente_Nombre': record.get('cliente_nombre', ''),
-                'Localidad_Entrega': record.get('localidad_entrega', ''),
-                'Codigo_Destino': record.get('codigo_destino', ''),
-                'Bultos': record.get('bultos', '0'),
-                'Cantidad': record.get('cantidad', 0.0),
-                'Peso_Neto': record.get('peso_neto', 0.0),
-                'Peso_Bruto': record.get('peso_bruto', 0.0)
-            }
-            writer.writerow(csv_record)
-        
+        self.write_csv_rows(delivery_records, output)
         csv_content = output.getvalue()
         output.close()
         
         return csv_content
     
+    def _spool(self):
+        """Temporary text file kept in memory until it grows beyond SPOOL_MAX_BYTES"""
+        return tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES, mode='w+', encoding='utf-8', newline='')
+    
+    def _format_csv_output(self, csv_output, record_count):
+        csv_output.seek(0)
+        return f"\n\n{csv_output.read()}\n\n REGISTROS ENCONTRADOS: {record_count} ==="
+    
+    def _format_text_output(self, text_content):
+        if not text_content:
+            return "No se pudo extraer texto del PDF"
+        # If no structured data found, return raw text
+        return f"=== NO SE PUDIERON EXTRAER DATOS ESTRUCTURADOS ===\n\n=== TEXTO EXTRAÍDO ===\n\n{text_content}"
+    
     def process_pdf_content(self, pdf_content):
         """Process PDF content and return structured CSV data"""
-        # Extract text from PDF
-        text_content = self.extract_text_from_pdf(pdf_content)
+        return self.process_pdf(pdf_content)[0]
+    
+    def process_pdf(self, pdf_content, cache_state=None):
+        """
+        Process PDF content into the structured CSV data and the DeliveryBatch it
+        was written from (None when no text could be extracted)
+        cache_state: result of a cache lookup already made for this PDF, if any
+        """
+        started = time.perf_counter()
+        try:
+            return self._process_pdf_content(pdf_content, cache_state)
+        finally:
+            self.metrics.incr('process.documents')
+            self.metrics.add_time('process', time.perf_counter() - started)
+    
+    def _process_pdf_content(self, pdf_content, cache_state=None):
+        """
+        Extract and parse a PDF into the content stored in Airtable
+        Pages are streamed into lines and lines into a columnar DeliveryBatch,
+        which is written to the CSV in one pass. The extracted text is spooled
+        to disk for the simple-parser fallback (or stored in the cache).
+        Large PDFs are extracted and parsed by page ranges in parallel.
+        """
+        key = None
+        if self.cache is not None:
+            key = self._cache_key(pdf_content)
+            if cache_state is None:
+                cache_state = self.cache.lookup(key)
+            if cache_state == 'hit':
+                return self._format_cached(key)
         
-        if not text_content:
-            return "No se pudo extraer texto del PDF"
+        entry = self.cache.writer(key, write_text=(cache_state == 'miss')) if key is not None else None
+        try:
+            with self._spool() as text_spool, self._spool() as csv_output:
+                stats = {}
+                page_count = None
+                if cache_state == 'text':
+                    # Parser changed: re-run only the regex stage on the cached text
+                    text_file = self.cache.open_text(key)
+                    text_chunks = text_file
+                else:
+                    text_file = entry.text if entry is not None else text_spool
+                    text_chunks = self._tee_text(self.iter_pdf_page_texts(pdf_content, stats), text_file)
+                    page_count = self._parallel_page_count(pdf_content)
+                
+                with text_file:
+                    if page_count:
+                        batch = self._parse_page_ranges(pdf_content, page_count, stats, text_file)
+                    else:
+                        batch = self.parse_delivery_lines(self.iter_text_lines(text_chunks), stats)
+                    
+                    if stats.get('extraction_failed'):
+                        if entry is not None:
+                            entry.discard()
+                            entry = None
+                        return "No se pudo extraer texto del PDF", None
+                    log.info(f"📊 Resumen: {stats['lines_processed']} líneas procesadas, "
+                             f"{stats['lines_matched']} líneas coincidieron")
+                    self.metrics.incr('parse.lines_processed', stats['lines_processed'])
+                    self.metrics.incr('parse.lines_matched', stats['lines_matched'])
+                    
+                    if not batch:
+                        text_file.seek(0)
+                        text_content = text_file.read().strip()
+                        
+                        # If advanced parsing didn't work, try simple parsing
+                        if text_content:
+                            batch = self.parse_simple_table_data(text_content)
+                
+                if entry is not None:
+                    entry.write_batch(batch)
+                    entry.commit()
+                    entry = None
+                
+                record_count = len(batch)
+                self.metrics.incr('parse.records', record_count)
+                if record_count:
+                    batch.write_csv(csv_output)
+                    return self._format_csv_output(csv_output, record_count), batch
+                return self._format_text_output(text_content), batch
+        finally:
+            if entry is not None:
+                entry.discard()
+    
+    def _parallel_page_count(self, pdf_content):
+        """Page count of a PDF large enough to be split into page ranges, else None"""
+        if self.page_parallel_threshold is None or self.page_workers < 2:
+            return None
+        engine = self.engines[0]
+        try:
+            document = engine.open(pdf_content)
+            try:
+                page_count = engine.page_count(document)
+            finally:
+                engine.close(document)
+        except Exception:
+            return None  # the sequential path reports the error or falls back
+        return page_count if page_count >= self.page_parallel_threshold else None
+    
+    def _parse_page_ranges(self, pdf_content, page_count, stats, text_file):
+        """
+        Extract and parse a large PDF as page_workers page ranges in parallel
+        Results are merged in page order: rows parsed before the first client header
+        of a range belong to the last client of the previous ranges, so the batch is
+        the same as a sequential parse.
+        """
+        if self.page_pool is None and self.cpu_pool is not None:
+            self.page_pool = self.cpu_pool
+        elif self.page_pool is None:
+            self.page_pool = ProcessPoolExecutor(max_workers=self.page_workers, initializer=_init_pdf_worker,
+                                                 initargs=(self.api_key, self.base_id, self.table_name,
+                                                           self.engines))
+            self._owns_page_pool = True
         
-        # Try advanced parsing first
-        delivery_records = self.parse_delivery_data_advanced(text_content)
+        range_size = -(-page_count // self.page_workers)
+        futures = [self.page_pool.submit(_parse_page_range_in_worker, pdf_content, first_page,
+                                         min(first_page + range_size, page_count))
+                   for first_page in range(0, page_count, range_size)]
+        log.info(f"🧩 PDF de {page_count} páginas dividido en {len(futures)} rangos en paralelo")
+        self.metrics.incr('extract.parallel_documents')
+        self.metrics.incr('extract.page_ranges', len(futures))
         
-        # If advanced parsing didn't work, try simple parsing
-        if not delivery_records:
-            delivery_records = self.parse_simple_table_data(text_content)
+        batch = DeliveryBatch()
+        stats['lines_processed'] = stats['lines_matched'] = 0
+        client = None
+        for future in futures:
+            page_texts, range_batch, range_stats, worker_metrics = future.result()
+            self.metrics.merge(worker_metrics)
+            if range_stats.get('extraction_failed'):
+                stats['extraction_failed'] = True
+            stats['lines_processed'] += range_stats['lines_processed']
+            stats['lines_matched'] += range_stats['lines_matched']
+            for page_text in page_texts:
+                text_file.write(page_text + "\n\n")
+            
+            if client is not None and range_stats['rows_before_client']:
+                range_batch.set_client(range_stats['rows_before_client'], *client)
+            if range_stats['last_client'] is not None:
+                client = range_stats['last_client']
+            batch.extend(range_batch)
+        return batch
+    
+    def _new_worker_pool(self, cpu_workers):
+        """Process pool for PDF extraction and parsing, with one extractor per worker"""
+        return ProcessPoolExecutor(max_workers=cpu_workers, initializer=_init_pdf_worker,
+                                   initargs=(self.api_key, self.base_id, self.table_name, self.engines,
+                                             self.cache.cache_dir if self.cache is not None else None,
+                                             self.cache.max_bytes if self.cache is not None else None))
+    
+    def start_worker_pool(self, cpu_workers=None):
+        """
+        Start a process pool kept across runs (used by the daemon) instead of one per run
+        Its workers are started right away, with the PDF libraries already imported.
+        """
+        self.cpu_pool_workers = cpu_workers or os.cpu_count() or 1
+        for engine in self.engines:
+            engine.load()
+        self.cpu_pool = self._new_worker_pool(self.cpu_pool_workers)
+        list(self.cpu_pool.map(_warm_up_worker, range(self.cpu_pool_workers)))
+    
+    def _replace_worker_pool(self, pool, cpu_workers):
+        """Discard a broken process pool and return a new one (restarting the kept pool if it was that one)"""
+        pool.shutdown(wait=False, cancel_futures=True)
+        if pool is self.cpu_pool:
+            self.cpu_pool = None
+            self.start_worker_pool(self.cpu_pool_workers)
+            return self.cpu_pool
+        return self._new_worker_pool(cpu_workers)
+    
+    def close_worker_pool(self):
+        """Shut down the pool started by start_worker_pool"""
+        if self.cpu_pool is not None:
+            self.cpu_pool.shutdown()
+            self.cpu_pool = None
+    
+    def _close_page_pool(self):
+        """Shut down the page range process pool if this extractor created it"""
+        if self._owns_page_pool:
+            self.page_pool.shutdown()
+            self._owns_page_pool = False
+        self.page_pool = None
+    
+    def _format_cached(self, key):
+        """Build the extraction output, and the cached batch if any, from a cache entry"""
+        batch = self.cache.load_batch(key)
+        if batch:
+            with self._spool() as csv_output:
+                batch.write_csv(csv_output)
+                return self._format_csv_output(csv_output, len(batch)), batch
+        with self.cache.open_text(key) as text_file:
+            return self._format_text_output(text_file.read().strip()), batch
+    
+    def _tee_text(self, page_texts, text_file):
+        """Copy page texts to text_file (joined like extract_text_from_pdf) while yielding them"""
+        for page_text in page_texts:
+            text_file.write(page_text + "\n\n")
+            yield page_text
+    
+    def _check_record(self, record, pdf_field_name, status_field_name):
+        """
+        Validate a fetched record before downloading its PDF
+        Returns (pdf_url, filename) or the final result ('skipped' / 'error')
+        """
+        record_id = record['id']
+        
+        if pdf_field_name not in record['fields']:
+            log.error(f"No PDF field '{pdf_field_name}' found in record {record_id}")
+            return 'error'
+        
+        pdf_attachments = record['fields'][pdf_field_name]
+        if not pdf_attachments:
+            log.error(f"No PDF attachments found in record {record_id}")
+            return 'error'
+        
+        pdf_url = pdf_attachments[0]['url']
+        filename = pdf_attachments[0].get('filename', 'unknown.pdf')
+        attachment_id = pdf_attachments[0].get('id')
+        
+        if self.checkpoint is not None and self.checkpoint.is_done(record_id, attachment_id):
+            log.info(f"⏭️ Ya procesado en la ejecución anterior (checkpoint): {filename}")
+            return 'skipped'
+        if self.failed_attachments is not None and (record_id, attachment_id) in self.failed_attachments:
+            log.info(f"⏭️ Ya falló con este adjunto, se reintenta cuando cambie: {filename}")
+            return 'skipped'
+        self.attachment_ids[record_id] = attachment_id
+        
+        # Verificar estado de procesamiento
+        current_status = record['fields'].get(status_field_name, 'Pendiente')
+        
+        if current_status == 'Procesado':
+            log.info(f"⏭️ Ya procesado: {filename}")
+            return 'skipped'
+        elif current_status == 'Error':
+            log.info(f"🔄 Reprocesando: {filename}")
+        else:
+            log.info(f"📄 Procesando nuevo: {filename}")
+        
+        return pdf_url, filename
+    
+    def _update_record(self, record_id, fields):
+        """Update a record, through the write buffer when a run is in progress"""
+        if record_id in self.leases_held:
+            self.leases_held.discard(record_id)
+            fields = {**fields, self.lease_field_name: None}  # The final update releases the lease
+        if self.write_buffer is not None:
+            self.write_buffer.update(record_id, fields)
+        else:
+            self.metrics.incr('airtable.update_calls')
+            self.table.update(record_id, fields)
+    
+    def _set_error(self, record_id, status_field_name):
+        """Mark a record as 'Error', remembering its attachment when failed_attachments is kept"""
+        if self.failed_attachments is not None and record_id in self.attachment_ids:
+            self.failed_attachments.add((record_id, self.attachment_ids[record_id]))
+        self._update_record(record_id, {status_field_name: 'Error'})
+    
+    def _mark_error(self, record_id, status_field_name):
+        """Mark a record as 'Error' in Airtable, ignoring failures"""
+        try:
+            self._set_error(record_id, status_field_name)
+        except:
+            pass
+    
+    def _start_run(self):
+        """Reset the run metrics and start buffering Airtable writes"""
+        self.metrics = RunMetrics()
+        self.downloader.metrics = self.metrics
+        self.run_started = time.perf_counter()
+        self.write_buffer = AirtableWriteBuffer(self.table, on_written=self._on_records_written,
+                                                metrics=self.metrics)
+        self.pending_rollups = {}
+        self.duplicates = {}
+    
+    def _on_records_written(self, chunk):
+        """Checkpoint records and apply their client rollups once their update is confirmed by Airtable"""
+        if self.pending_rollups:
+            for update in chunk:
+                pending = self.pending_rollups.pop(update['id'], None)
+                if pending is not None:
+                    self.rollups.update_document(update['id'], *pending)
+        if self.checkpoint is None:
+            return
+        for update in chunk:
+            if update['id'] in self.attachment_ids:
+                self.checkpoint.mark(update['id'], self.attachment_ids[update['id']])
+        self.checkpoint.save()
+    
+    def _sync_client_rollups(self, skip_unchanged=False):
+        """
+        Save the client rollups and upsert the clients changed by this run into the summary table
+        skip_unchanged: first read the summary table and leave out the clients whose row
+        already has their totals (used when the rollups were recomputed from scratch)
+        """
+        if self.rollups is None or self.pending_rollups is None:
+            return
+        self.pending_rollups = None
+        if self.summary_table is not None:
+            changed = self.rollups.take_pending()
+            if changed and skip_unchanged:
+                changed = self._changed_summary_rows(changed)
+            if changed:
+                started = time.perf_counter()
+                try:
+                    self.summary_table.batch_upsert(
+                        [{'fields': client_summary_fields(client, totals)} for client, totals in changed.items()],
+                        key_fields=['Cliente_Nombre'])
+                    self.metrics.incr('airtable.summary_upserts', len(changed))
+                    log.info(f"👥 Totales por cliente actualizados: {len(changed)} clientes")
+                except Exception as e:
+                    log.error(f"❌ No se pudo actualizar la tabla de totales por cliente: {e}")
+                    self.rollups.restore_pending(changed)
+                finally:
+                    self.metrics.add_time('airtable', time.perf_counter() - started)
+        try:
+            self.rollups.save()
+        except OSError as e:
+            log.warning(f"⚠️ No se pudieron guardar los totales por cliente: {e}")
+    
+    def _changed_summary_rows(self, clients):
+        """The clients whose row in the summary table is missing or differs from their totals"""
+        rows = {client: client_summary_fields(client, totals) for client, totals in clients.items()}
+        started = time.perf_counter()
+        try:
+            existing = self._fetch_summary_rows(list(client_summary_fields('', None)))
+        except Exception as e:
+            log.warning(f"⚠️ No se pudo leer la tabla de totales por cliente, se actualizan todos: {e}")
+            return clients
+        finally:
+            self.metrics.add_time('airtable', time.perf_counter() - started)
+        # Airtable leaves empty fields out of the records it returns
+        unchanged = {client for client, fields in rows.items() if client in existing
+                     and all((existing[client].get(name) or None) == (value or None) for name, value in fields.items())}
+        if unchanged:
+            log.info(f"👥 {len(unchanged)} clientes ya estaban al día en la tabla de totales")
+        return {client: totals for client, totals in clients.items() if client not in unchanged}
+    
+    def _fetch_summary_rows(self, fields):
+        rows = {}
+        for page in self.summary_table.iterate(fields=fields):
+            self.metrics.incr('airtable.fetch_calls')
+            for row in page:
+                rows[row['fields'].get('Cliente_Nombre')] = row['fields']
+        return rows
+    
+    def rebuild_parquet_dataset(self, pdf_field_name, output_field_name, status_field_name):
+        """
+        Export the CSV already stored in 'Procesado' records to the Parquet dataset
+        Used once to seed the dataset with the documents processed before it existed
+        (chofer_code is not part of the stored CSV, so those rows have it empty).
+        """
+        log.info("🗃️ Exportando a Parquet los CSV guardados...")
+        try:
+            records = self._fetch_records(f"{{{status_field_name}}} = 'Procesado'",
+                                          [pdf_field_name, output_field_name])
+        except Exception as e:
+            log.error(f"❌ Error exportando a Parquet: {e}")
+            return
+        for record_id, filename, batch in self._iter_stored_batches(records, pdf_field_name, output_field_name):
+            self._export_records(record_id, filename, batch)
+        log.info(f"🗃️ {self.metrics.get('parquet.rows')} registros de {len(records)} documentos "
+                 f"exportados a {self.parquet_sink.root}")
+    
+    def sync_stored_documents(self, pdf_field_name, output_field_name, status_field_name, full=False):
+        """
+        Apply the CSV stored in 'Procesado' records to the client rollups and the delivery index
+        Only the records whose CSV changed since the last pass of both stores (minus
+        STORED_DOCUMENTS_MARGIN) are fetched; with full=True, or a store that never had a
+        pass, every stored CSV is, and only the clients whose summary row differs are
+        upserted. Runs before each run, to seed the stores and catch up with documents
+        stored by other workers (sharded runs, or a state file restored from an older
+        run); applying a document again does not change either store.
+        The pass is written to the JSON summary, with the duplicated deliveries found,
+        and is also included in the summary of the next run.
+        """
+        if self.rollups is None and self.delivery_index is None:
+            return
+        started = time.perf_counter()
+        started_at = datetime.now(timezone.utc).isoformat(timespec='seconds')
+        watermarks = [store.synced_at for store in (self.rollups, self.delivery_index) if store is not None]
+        formula = f"{{{status_field_name}}} = 'Procesado'"
+        full = full or not all(watermarks)
+        if full:
+            log.info("👥 Recalculando totales por cliente y entregas desde todos los CSV guardados...")
+        else:
+            since = min(datetime.fromisoformat(watermark) for watermark in watermarks) - STORED_DOCUMENTS_MARGIN
+            formula = (f"AND({formula}, IS_AFTER(LAST_MODIFIED_TIME({{{output_field_name}}}), "
+                       f"DATETIME_PARSE('{since.isoformat(timespec='seconds')}')))")
+            log.info(f"👥 Aplicando los CSV guardados desde {since:%Y-%m-%d %H:%M} UTC...")
+        try:
+            records = self._fetch_records(formula, [pdf_field_name, output_field_name])
+        except Exception as e:
+            log.error(f"❌ Error leyendo los CSV guardados: {e}")
+            return
+        
+        if self.rollups is not None:
+            self.pending_rollups = {}
+        for record_id, filename, batch in self._iter_stored_batches(records, pdf_field_name, output_field_name):
+            if self.rollups is not None:
+                self.rollups.update_document(record_id, filename, client_totals(batch) if batch is not None else {})
+            if self.delivery_index is not None and batch is not None:
+                self._report_duplicates(record_id, filename, batch.keys())
+        if self.rollups is not None:
+            self.rollups.synced_at = started_at
+            self._sync_client_rollups(skip_unchanged=full)
+        if self.delivery_index is not None:
+            self.delivery_index.synced_at = started_at
+            self.delivery_index.save()
+        log.info(f"👥 {len(records)} documentos aplicados"
+                 + (f", {len(self.rollups.clients)} clientes" if self.rollups is not None else "")
+                 + (f", {len(self.delivery_index)} entregas indexadas ({len(self.duplicates)} con duplicados)"
+                    if self.delivery_index is not None else ""))
+        
+        self.stored_documents_summary = {'full': full, 'documents': len(records)}
+        if self.rollups is not None:
+            self.stored_documents_summary['clients'] = len(self.rollups.clients)
+        if self.delivery_index is not None:
+            self.stored_documents_summary['deliveries'] = len(self.delivery_index)
+            self.stored_documents_summary['duplicates'] = dict(self.duplicates)
+        self._write_summary({
+            'finished_at': datetime.now().isoformat(timespec='seconds'),
+            'duration_s': round(time.perf_counter() - started, 3),
+            'stored_documents': self.stored_documents_summary,
+            'duplicates': dict(self.duplicates),
+            'stages': self.metrics.to_dict()
+        })
+    
+    def _iter_stored_batches(self, records, pdf_field_name, output_field_name):
+        """Yield (record_id, filename, batch) for the CSV stored in each record (batch None if not a CSV)"""
+        for record in records:
+            content = record['fields'].get(output_field_name) or ''
+            csv_text = content.strip().rsplit("\n\n REGISTROS ENCONTRADOS:", 1)[0]
+            try:
+                batch = DeliveryBatch.from_csv(csv_text)
+            except ValueError as e:
+                log.warning(f"⚠️ CSV ilegible en {record['id']}: {e}")
+                continue
+            documento = record['fields'].get(pdf_field_name) or [{}]
+            yield record['id'], documento[0].get('filename', 'unknown.pdf'), batch
+    
+    def _iter_claimed_records(self, records, pdf_field_name, status_field_name, chunk_size=10):
+        """
+        Yield the records with a PDF that this worker should process
+        Only records of this worker's shard are kept. With leases, records are claimed in
+        chunks of chunk_size right before they are yielded; records leased by another
+        live worker, or lost to another worker while claiming, are left out.
+        """
+        candidates = [record for record in records
+                      if record['fields'].get(pdf_field_name)
+                      and (self.shard_count == 1 or record_shard(record['id'], self.shard_count) == self.shard_index)]
+        if not self.lease_seconds:
+            yield from candidates
+            return
+        
+        leases = RecordLeases(self.table, status_field_name, self.lease_field_name, self.worker_id,
+                              self.lease_seconds, metrics=self.metrics)
+        chunk = []
+        for record in candidates:
+            if record['fields'].get(status_field_name) == 'Procesado' or self._checkpoint_done(record, pdf_field_name):
+                yield record  # Skipped by _check_record, no lease needed
+                continue
+            if leases.held_elsewhere(record['fields'].get(self.lease_field_name)):
+                log.info(f"🔒 {record['id']} está siendo procesado por otro worker")
+                self.metrics.incr('lease.held_elsewhere')
+                continue
+            chunk.append(record)
+            if len(chunk) == chunk_size:
+                yield from self._claim(leases, chunk)
+                chunk = []
+        yield from self._claim(leases, chunk)
+    
+    def _claim(self, leases, records):
+        """Claim records, remembering them until they get a final update"""
+        claimed = leases.claim(records)
+        self.leases_held.update(record['id'] for record in claimed)
+        return claimed
+    
+    def _release_leases(self):
+        """Clear the lease of claimed records that got no final update (e.g. skipped)"""
+        for record_id in list(self.leases_held):
+            self._update_record(record_id, {})
+    
+    def _checkpoint_done(self, record, pdf_field_name):
+        """True if the checkpoint has the record's current attachment as processed"""
+        if self.checkpoint is None:
+            return False
+        attachments = record['fields'].get(pdf_field_name) or [{}]
+        return self.checkpoint.is_done(record['id'], attachments[0].get('id'))
+    
+    def _fetch_records(self, filter_formula=None, fields=None):
+        """Fetch records, filtering and selecting fields on the Airtable side"""
+        options = {}
+        if filter_formula:
+            options['formula'] = filter_formula
+        if fields:
+            options['fields'] = fields
+        
+        records = []
+        started = time.perf_counter()
+        for page in self.table.iterate(**options):
+            self.metrics.incr('airtable.fetch_calls')
+            records.extend(page)
+        self.metrics.add_time('airtable', time.perf_counter() - started)
+        self.metrics.incr('airtable.records_fetched', len(records))
+        return records
+    
+    def _close_write_buffer(self):
+        """
+        Release the leases left on claimed records and flush pending updates at the end of a run
+        Returns the ids of the records whose updates could not be written to Airtable
+        """
+        self._release_leases()
+        failed = set()
+        if self.write_buffer is not None:
+            self.write_buffer.close()
+            failed = {update['id'] for update in self.write_buffer.failed}
+            self.write_buffer = None
+        return failed
+    
+    def _finish_run_writes(self, outcomes, counts):
+        """
+        Flush the run's updates and count as errors the successful records whose final
+        update failed: they keep their previous status in Airtable
+        Returns how many records were moved from 'success' to 'error' in counts
+        """
+        failed = [record_id for record_id in self._close_write_buffer() if outcomes.get(record_id) == 'success']
+        for record_id in failed:
+            outcomes[record_id] = 'error'
+        counts['success'] -= len(failed)
+        counts['error'] += len(failed)
+        if failed:
+            log.error(f"❌ {len(failed)} registros procesados quedan sin guardar en Airtable y se cuentan como error")
+        return len(failed)
+    
+    def _store_extraction(self, record_id, filename, extracted_content, output_field_name, status_field_name,
+                          batch=None):
+        """
+        Validate the extracted content and write it back to Airtable
+        The document's DeliveryBatch feeds the client rollups (applied on success), the
+        delivery index and the Parquet dataset, when they are kept.
+        """
+        # Validate extraction quality
+        if len(extracted_content) < 500:
+            log.warning(f"⚠️ ADVERTENCIA: Extracción muy corta ({len(extracted_content)} caracteres) para {filename}")
+            log.warning(f"📝 Contenido extraído: {extracted_content[:200]}...")
+            log.warning(f"❌ Marcando como ERROR en Airtable")
+            self._set_error(record_id, status_field_name)
+            return 'error'
+        
+        # Validate that we found at least some records
+        if "REGISTROS ENCONTRADOS: 0" in extracted_content:
+            log.warning(f"⚠️ ADVERTENCIA: No se encontraron registros válidos para {filename}")
+            log.warning(f"📝 Contenido extraído: {extracted_content[:200]}...")
+            log.warning(f"❌ Marcando como ERROR en Airtable")
+            self._set_error(record_id, status_field_name)
+            return 'error'
+        
+        # Debug: mostrar el contenido extraído
+        log.debug(f"📝 Contenido extraído (primeros 200 chars): {extracted_content[:200]}...")
+        log.debug(f"📏 Longitud del contenido: {len(extracted_content)}")
+        
+        keys = self._delivery_keys(batch)
+        if keys is not None:
+            self._report_duplicates(record_id, filename, keys)
+        if self.parquet_sink is not None:
+            self._export_records(record_id, filename, batch)
+        
+        # During a run, rollups are applied once the update below is written
+        totals = self._client_totals(batch)
+        if totals is not None and self.pending_rollups is not None:
+            self.pending_rollups[record_id] = (filename, totals)
         
         # If we found structured data, convert to CSV
-        if delivery_records:
-            csv_content = self.convert_to_csv_string(delivery_records)
-            return f"\n\n{csv_content}\n\n REGISTROS ENCONTRADOS: {len(delivery_records)} ==="
+        if extracted_content.startswith("\n\n") and extracted_content.endswith("\n\n REGISTROS ENCONTRADOS:"):
+            csv_content = extracted_content[2:-2] # Remove the first two newlines and last two newlines
+            self._update_record(record_id, {
+                output_field_name: csv_content,
+                status_field_name: 'Procesado'
+            })
         else:
             # If no structured data found, return raw text
-            return f"=== NO SE PUDIERON EXTRAER DATOS ESTRUCTURADOS ===\n\n=== TEXTO EXTRAÍDO ===\n\n{text_content}"
+            self._update_record(record_id, {
+                output_field_name: extracted_content,
+                status_field_name: 'Procesado'
+            })
+        log.info(f"✅ Successfully processed {filename}")
+        return 'success'
+    
+    def _needs_batch(self):
+        """Whether stored extractions need their DeliveryBatch (rollups, index or dataset)"""
+        return self.rollups is not None or self.delivery_index is not None or self.parquet_sink is not None
+    
+    def _client_totals(self, batch):
+        """Client totals of a processed document, when rollups are kept"""
+        if self.rollups is None:
+            return None
+        return client_totals(batch) if batch is not None else {}
+    
+    def _delivery_keys(self, batch):
+        """(remito, transac_nr) of a processed document, when the delivery index is kept"""
+        if self.delivery_index is None:
+            return None
+        return batch.keys() if batch is not None else []
     
-    def process_record(self, record_id, pdf_field_name, output_field_name, status_field_name):
-        """Process a single Airtable record"""
+    def _report_duplicates(self, record_id, filename, keys):
+        """Record a document's deliveries in the index and report the ones seen before"""
+        duplicates = self.delivery_index.check(record_id, filename, keys, self.metrics)
+        if not duplicates:
+            self.duplicates.pop(record_id, None)
+            return
+        first_seen = {}
+        for _, _, _, documento in duplicates:
+            first_seen[documento] = first_seen.get(documento, 0) + 1
+        log.warning(f"🔁 {filename}: {len(duplicates)} entregas ya registradas en "
+                    + ", ".join(f"{documento} ({count})" for documento, count in first_seen.items()))
+        self.duplicates[record_id] = {'documento': filename, 'duplicados': len(duplicates),
+                                      'primera_vez_en': first_seen}
+    
+    def _export_records(self, record_id, filename, batch):
+        """Replace the document's rows in the Parquet dataset; failures are logged, not fatal"""
+        started = time.perf_counter()
         try:
-            record = self.table.get(record_id)
-            
-            if pdf_field_name not in record['fields']:
-                print(f"No PDF field '{pdf_field_name}' found in record {record_id}")
-                return 'error'
-            
-            pdf_attachments = record['fields'][pdf_field_name]
-            if not pdf_attachments:
-                print(f"No PDF attachments found in record {record_id}")
-                return 'error'
-            
-            pdf_url = pdf_attachments[0]['url']
-            filename = pdf_attachments[0].get('filename', 'unknown.pdf')
-            
-            # Verificar estado de procesamiento
-            current_status = record['fields'].get(status_field_name, 'Pendiente')
+            written = self.parquet_sink.write_document(record_id, filename, batch)
+        except Exception as e:
+            log.error(f"❌ Error exportando {filename} a Parquet: {e}")
+            self.metrics.incr('parquet.errors')
+            return
+        self.metrics.add_time('parquet', time.perf_counter() - started)
+        self.metrics.incr('parquet.files', written)
+        self.metrics.incr('parquet.rows', len(batch) if batch is not None else 0)
+    
+    def process_record(self, record_id, pdf_field_name, output_field_name, status_field_name, record=None):
+        """
+        Process a single Airtable record
+        Pass the already fetched record to avoid fetching it again
+        """
+        try:
+            if record is None:
+                record = self.table.get(record_id)
             
-            if current_status == 'Procesado':
-                print(f"⏭️ Ya procesado: {filename}")
-                return 'skipped'
-            elif current_status == 'Error':
-                print(f"🔄 Reprocesando: {filename}")
-            else:
-                print(f"📄 Procesando nuevo: {filename}")
+            checked = self._check_record(record, pdf_field_name, status_field_name)
+            if isinstance(checked, str):
+                return checked
+            pdf_url, filename = checked
             
-            pdf_content = self.download_pdf_from_url(pdf_url)
+            pdf_content = self.download_pdf_from_url(pdf_url, self._attachment_url_refresher(record, pdf_field_name))
             if not pdf_content:
-                print(f"Failed to download PDF: {filename}")
+                log.error(f"Failed to download PDF: {filename}")
                 # Marcar como error
-                self.table.update(record_id, {status_field_name: 'Error'})
-                return 'error'
-            
-            extracted_content = self.process_pdf_content(pdf_content)
-            
-            # Validate extraction quality
-            if len(extracted_content) < 500:
-                print(f"⚠️ ADVERTENCIA: Extracción muy corta ({len(extracted_content)} caracteres) para {filename}")
-                print(f"📝 Contenido extraído: {extracted_content[:200]}...")
-                print(f"❌ Marcando como ERROR en Airtable")
-                self.table.update(record_id, {status_field_name: 'Error'})
+                self._set_error(record_id, status_field_name)
                 return 'error'
             
-            # Validate that we found at least some records
-            if "REGISTROS ENCONTRADOS: 0" in extracted_content:
-                print(f"⚠️ ADVERTENCIA: No se encontraron registros válidos para {filename}")
-                print(f"📝 Contenido extraído: {extracted_content[:200]}...")
-                print(f"❌ Marcando como ERROR en Airtable")
-                self.table.update(record_id, {status_field_name: 'Error'})
-                return 'error'
+            extracted_content, batch = self.process_pdf(pdf_content)
             
-            # Debug: mostrar el contenido extraído
-            print(f"📝 Contenido extraído (primeros 200 chars): {extracted_content[:200]}...")
-            print(f"📏 Longitud del contenido: {len(extracted_content)}")
-            
-            # If we found structured data, convert to CSV
-            if extracted_content.startswith("\n\n") and extracted_content.endswith("\n\n REGISTROS ENCONTRADOS:"):
-                csv_content = extracted_content[2:-2] # Remove the first two newlines and last two newlines
-                self.table.update(record_id, {
-                    output_field_name: csv_content,
-                    status_field_name: 'Procesado'
-                })
-                print(f"✅ Successfully processed {filename}")
-                return 'success'
-            else:
-                # If no structured data found, return raw text
-                self.table.update(record_id, {
-                    output_field_name: extracted_content,
-                    status_field_name: 'Procesado'
-                })
-                print(f"✅ Successfully processed {filename}")
-                return 'success'
+            return self._store_extraction(record_id, filename, extracted_content, output_field_name, status_field_name,
+                                          batch)
             
         except Exception as e:
-            print(f"❌ Error processing record {record_id}: {e}")
+            log.error(f"❌ Error processing record {record_id}: {e}")
             # Marcar como error
-            try:
-                self.table.update(record_id, {status_field_name: 'Error'})
-            except:
-                pass
+            self._mark_error(record_id, status_field_name)
             return 'error'
     
-    def process_all_records(self, pdf_field_name, output_field_name, status_field_name, filter_formula=None):
-        """Process all records in the table that have PDF attachments"""
+    def _print_summary(self, processed_count, success_count, skipped_count, error_count):
+        """Print the totals of a processing run, followed by the JSON summary"""
+        print(f"\n🎉 Processing complete!")
+        print(f"📊 Records with PDFs: {processed_count}")
+        print(f"✅ Successfully processed: {success_count}")
+        print(f"⏭️ Skipped (already processed): {skipped_count}")
+        print(f"❌ Failed: {error_count}")
+        
+        metrics = self.metrics.to_dict()
+        engine_pages = {name[len('pages_'):]: count for name, count in metrics.get('extract', {}).items()
+                        if name.startswith('pages_')}
+        if engine_pages:
+            summary = ", ".join(f"{name}: {count}" for name, count in engine_pages.items())
+            print(f"⚡ Páginas por motor: {summary} "
+                  f"({metrics['extract'].get('fallback_pages', 0)} con fallback a {self.engines[-1].name})")
+        airtable = metrics.get('airtable', {})
+        print(f"📡 Llamadas a Airtable: {airtable.get('fetch_calls', 0)} lecturas, "
+              f"{airtable.get('batch_calls', 0) + airtable.get('update_calls', 0)} escrituras, "
+              f"{airtable.get('retries', 0)} reintentos")
+        if self.cache is not None:
+            print(self.cache.summary())
+        
+        summary = {
+            'finished_at': datetime.now().isoformat(timespec='seconds'),
+            'duration_s': round(time.perf_counter() - self.run_started, 3) if self.run_started else None,
+            'records': {'with_pdf': processed_count, 'success': success_count,
+                        'skipped': skipped_count, 'error': error_count},
+            'stages': metrics
+        }
+        if self.duplicates:
+            summary['duplicates'] = self.duplicates
+        if self.stored_documents_summary is not None:
+            summary['stored_documents'] = self.stored_documents_summary
+            self.stored_documents_summary = None
+        if self.cache is not None:
+            summary['cache'] = {'hits': self.cache.hits, 'text_hits': self.cache.text_hits,
+                                'misses': self.cache.misses, 'bytes': self.cache.total_bytes}
+        self._write_summary(summary)
+    
+    def _write_summary(self, summary):
+        """Print the JSON summary and write it to summary_path"""
+        summary_json = json.dumps(summary, ensure_ascii=False)
+        print(f"📈 RUN_SUMMARY {summary_json}")
+        if self.summary_path:
+            with open(self.summary_path, 'w', encoding='utf-8') as f:
+                f.write(summary_json + "\n")
+    
+    def process_all_records(self, pdf_field_name, output_field_name, status_field_name, filter_formula=None,
+                            fields=None):
+        """
+        Process all records in the table that have PDF attachments
+        Returns the result counts, or None if the run failed
+        """
         try:
-            print("🚀 Starting improved PDF processing...")
+            log.info("🚀 Starting improved PDF processing...")
             
-            records = self.table.all(formula=filter_formula) if filter_formula else self.table.all()
+            self._start_run()
+            records = self._fetch_records(filter_formula, fields)
             
             processed_count = 0
-            success_count = 0
-            skipped_count = 0
-            error_count = 0
+            counts = {'success': 0, 'skipped': 0, 'error': 0}
+            outcomes = {}
             
-            for record in records:
-                record_id = record['id']
+            for record in self._iter_claimed_records(records, pdf_field_name, status_field_name):
+                processed_count += 1
+                log.info(f"📄 Processing record {processed_count}...")
                 
-                if pdf_field_name in record['fields'] and record['fields'][pdf_field_name]:
-                    processed_count += 1
-                    print(f"\n📄 Processing record {processed_count}...")
+                result = self.process_record(record['id'], pdf_field_name, output_field_name, status_field_name,
+                                             record=record)
+                if result not in ('success', 'skipped'):
+                    result = 'error'
+                counts[result] += 1
+                outcomes[record['id']] = result
+            
+            failed_writes = self._finish_run_writes(outcomes, counts)
+            self._sync_client_rollups()
+            self._print_summary(processed_count, counts['success'], counts['skipped'], counts['error'])
+            return dict(counts, processed=processed_count, failed_writes=failed_writes)
+            
+        except Exception as e:
+            log.error(f"❌ Error processing records: {e}")
+        finally:
+            self._close_write_buffer()
+            self._sync_client_rollups()
+            self._close_page_pool()
+            if self.delivery_index is not None:
+                self.delivery_index.save()
+    
+    def process_all_records_pipelined(self, pdf_field_name, output_field_name, status_field_name,
+                                      filter_formula=None, fields=None, io_workers=4, cpu_workers=None,
+                                      max_pending=None):
+        """
+        Process all records overlapping downloads, PDF parsing and Airtable writes
+        Downloads and updates run on a thread pool of io_workers, text extraction and
+        parsing on a process pool of cpu_workers (defaults to the CPU count).
+        At most max_pending records are in flight at once, so a slow stage holds back
+        the record loop instead of buffering every PDF in memory.
+        If a worker process dies, the pool is replaced and the records it broke are
+        retried once before being marked as errors.
+        Returns the result counts, or None if the run failed
+        """
+        cpu_pool = None
+        own_pool = self.cpu_pool is None
+        try:
+            log.info("🚀 Starting pipelined PDF processing...")
+            
+            self._start_run()
+            records = self._fetch_records(filter_formula, fields)
+            
+            if self.cpu_pool is not None:
+                cpu_workers = self.cpu_pool_workers
+            cpu_workers = cpu_workers or os.cpu_count() or 1
+            max_pending = max_pending or 2 * (io_workers + cpu_workers)
+            log.info(f"⚙️ Workers: {io_workers} I/O, {cpu_workers} CPU, {max_pending} en vuelo como máximo")
+            
+            counts = {'success': 0, 'skipped': 0, 'error': 0}
+            outcomes = {}
+            counts_lock = threading.Lock()
+            slots = threading.BoundedSemaphore(max_pending)
+            retry_records = []
+            final_pass = False
+            
+            def finish(record_id, result):
+                with counts_lock:
+                    counts[result] += 1
+                    outcomes[record_id] = result
+                slots.release()
+            
+            def fail(record_id, e):
+                log.error(f"❌ Error processing record {record_id}: {e}")
+                self._mark_error(record_id, status_field_name)
+                finish(record_id, 'error')
+            
+            def fail_or_retry(record, e):
+                # A dead worker breaks the whole pool: its records are retried on a new one
+                if isinstance(e, BrokenProcessPool) and not final_pass:
+                    with counts_lock:
+                        retry_records.append(record)
+                    slots.release()
+                else:
+                    fail(record['id'], e)
+            
+            def store_stage(record_id, filename, extracted_content, batch):
+                try:
+                    finish(record_id, self._store_extraction(record_id, filename, extracted_content,
+                                                             output_field_name, status_field_name, batch))
+                except Exception as e:
+                    fail(record_id, e)
+            
+            def on_parsed(record, filename, future):
+                try:
+                    extracted_content, batch, worker_metrics = future.result()
+                    self.metrics.merge(worker_metrics)
+                    io_pool.submit(store_stage, record['id'], filename, extracted_content, batch)
+                except Exception as e:
+                    io_pool.submit(fail_or_retry, record, e)
+            
+            def download_stage(record):
+                record_id = record['id']
+                try:
+                    checked = self._check_record(record, pdf_field_name, status_field_name)
+                    if isinstance(checked, str):
+                        finish(record_id, checked)
+                        return
+                    pdf_url, filename = checked
                     
-                    result = self.process_record(record_id, pdf_field_name, output_field_name, status_field_name)
-                    if result == 'success':
-                        success_count += 1
-                    elif result == 'skipped':
-                        skipped_count += 1
-                    else:
-                        error_count += 1
+                    pdf_content = self.download_pdf_from_url(
+                        pdf_url, self._attachment_url_refresher(record, pdf_field_name))
+                    if not pdf_content:
+                        log.error(f"Failed to download PDF: {filename}")
+                        self._set_error(record_id, status_field_name)
+                        finish(record_id, 'error')
+                        return
+                    
+                    # Cache lookups run here so the hit/miss counters stay in this process;
+                    # the worker gets the result and writes its extraction to the same directory
+                    cache_state = None
+                    if self.cache is not None:
+                        cache_key = self._cache_key(pdf_content)
+                        cache_state = self.cache.lookup(cache_key)
+                        if cache_state == 'hit':
+                            extracted_content, batch = self._format_cached(cache_key)
+                            finish(record_id, self._store_extraction(record_id, filename, extracted_content,
+                                                                     output_field_name, status_field_name, batch))
+                            return
+                    
+                    # Large PDFs are split here into page ranges on the same process pool
+                    if cache_state != 'text' and self._parallel_page_count(pdf_content):
+                        extracted_content, batch = self.process_pdf(pdf_content, cache_state)
+                        finish(record_id, self._store_extraction(record_id, filename, extracted_content,
+                                                                 output_field_name, status_field_name, batch))
+                        return
+                    
+                    future = cpu_pool.submit(_process_pdf_in_worker, pdf_content, self._needs_batch(), cache_state)
+                    future.add_done_callback(lambda f: on_parsed(record, filename, f))
+                except Exception as e:
+                    fail_or_retry(record, e)
             
-            print(f"\n🎉 Processing complete!")
-            print(f"📊 Records with PDFs: {processed_count}")
-            print(f"✅ Successfully processed: {success_count}")
-            print(f"⏭️ Skipped (already processed): {skipped_count}")
-            print(f"❌ Failed: {error_count}")
+            processed_count = 0
+            
+            # A pool started with start_worker_pool is reused and left running
+            cpu_pool = self._new_worker_pool(cpu_workers) if own_pool else self.cpu_pool
+            with ThreadPoolExecutor(max_workers=io_workers) as io_pool:
+                records_to_process = self._iter_claimed_records(records, pdf_field_name, status_field_name)
+                while True:
+                    self.page_pool = cpu_pool
+                    for record in records_to_process:
+                        if not final_pass:
+                            processed_count += 1
+                            log.info(f"📄 Processing record {processed_count}...")
+                        
+                        slots.acquire()
+                        io_pool.submit(download_stage, record)
+                    
+                    # Esperar a que terminen todos los registros en vuelo
+                    for _ in range(max_pending):
+                        slots.acquire()
+                    for _ in range(max_pending):
+                        slots.release()
+                    
+                    if not retry_records:
+                        break
+                    log.warning(f"⚠️ Un proceso de extracción terminó inesperadamente: se reinicia el pool "
+                                f"y se reintentan {len(retry_records)} registros")
+                    self.metrics.incr('process.pool_restarts')
+                    cpu_pool = self._replace_worker_pool(cpu_pool, cpu_workers)
+                    records_to_process, retry_records = list(retry_records), []
+                    final_pass = True
+            
+            failed_writes = self._finish_run_writes(outcomes, counts)
+            self._sync_client_rollups()
+            self._print_summary(processed_count, counts['success'], counts['skipped'], counts['error'])
+            return dict(counts, processed=processed_count, failed_writes=failed_writes)
             
         except Exception as e:
-            print(f"❌ Error processing records: {e}")
+            log.error(f"❌ Error processing records: {e}")
+        finally:
+            self.page_pool = None
+            if own_pool and cpu_pool is not None:
+                cpu_pool.shutdown()
+            self._close_write_buffer()
+            self._sync_client_rollups()
+            if self.delivery_index is not None:
+                self.delivery_index.save()
+    
+    def pending_records_formula(self, pdf_field_name, status_field_name):
+        """Airtable formula matching records with a PDF that are not 'Procesado' yet"""
+        return f"AND({{{pdf_field_name}}}, {{{status_field_name}}} != 'Procesado')"
+    
+    def process_pending_records(self, pdf_field_name, output_field_name, status_field_name,
+                                pipelined=True, **pipeline_options):
+        """
+        Incremental sync: only fetch pending/error records with attachments, and only
+        the fields needed to process them. With a checkpoint, records finished by an
+        interrupted run are skipped and the checkpoint is cleared once the run completes
+        with every update written to Airtable.
+        """
+        log.info("🔁 Sincronización incremental (solo registros pendientes o con error)")
+        
+        fields = [pdf_field_name, status_field_name]
+        if self.lease_seconds:
+            fields.append(self.lease_field_name)
+        options = {
+            'filter_formula': self.pending_records_formula(pdf_field_name, status_field_name),
+            'fields': fields
+        }
+        
+        if pipelined:
+            result = self.process_all_records_pipelined(pdf_field_name, output_field_name, status_field_name,
+                                                        **options, **pipeline_options)
+        else:
+            result = self.process_all_records(pdf_field_name, output_field_name, status_field_name, **options)
+        
+        if result is not None and self.checkpoint is not None:
+            if result['failed_writes']:
+                log.warning("⚠️ Hubo actualizaciones sin guardar en Airtable: se conserva el checkpoint")
+            else:
+                self.checkpoint.clear()
+        return result
+
+# Process pool workers keep their own extractor, created once per process
+_worker_extractor = None
+
+def _init_pdf_worker(api_key, base_id, table_name, engines, cache_dir=None, cache_max_bytes=None):
+    """Initializer for the CPU-bound process pool"""
+    global _worker_extractor
+    cache = PDFExtractionCache(cache_dir, cache_max_bytes) if cache_dir else None
+    _worker_extractor = ImprovedPDFExtractor(api_key, base_id, table_name, cache=cache, engines=engines)
+
+def _process_pdf_in_worker(pdf_content, with_batch=False, cache_state=None):
+    """
+    Extract and parse a PDF inside a process pool worker
+    cache_state: result of the cache lookup made by the parent process
+    Returns the extracted content, its DeliveryBatch (when requested) and the metrics
+    collected while processing it
+    """
+    extracted_content, batch = _worker_extractor.process_pdf(pdf_content, cache_state)
+    return extracted_content, batch if with_batch else None, _worker_extractor.metrics.take()
+
+def _warm_up_worker(_):
+    """Import the PDF libraries of a process pool worker ahead of its first document"""
+    for engine in _worker_extractor.engines:
+        engine.load()
+    return os.getpid()
+
+def _parse_page_range_in_worker(pdf_content, first_page, last_page):
+    """
+    Extract and parse a range of PDF pages inside a process pool worker
+    Returns the page texts, their DeliveryBatch, the parse stats and the metrics
+    """
+    stats = {}
+    page_texts = list(_worker_extractor.iter_pdf_page_texts(pdf_content, stats, first_page, last_page))
+    batch = _worker_extractor.parse_delivery_lines(_worker_extractor.iter_text_lines(page_texts), stats)
+    return page_texts, batch, stats, _worker_extractor.metrics.take()
+
+class ExtractorDaemon:
+    """
+    Long-running processor that keeps an ImprovedPDFExtractor warm between runs
+    The Airtable and download sessions, the compiled patterns and a started process pool
+    are reused by every run. A run processes the pending records and is triggered by
+    POST /run on a local HTTP endpoint and/or every poll_seconds; triggers received
+    during a run are coalesced into a single next run. Records that end in 'Error' are
+    not retried by later runs until their attachment changes (or the daemon restarts).
+    """
+    def __init__(self, extractor, pdf_field_name, output_field_name, status_field_name, pipelined=True,
+                 pipeline_options=None, poll_seconds=None, token=None):
+        self.extractor = extractor
+        self.fields = (pdf_field_name, output_field_name, status_field_name)
+        self.pipelined = pipelined
+        self.pipeline_options = dict(pipeline_options or {})
+        self.poll_seconds = poll_seconds
+        self.token = token
+        self.server = None
+        self.wakeup = threading.Event()
+        self.stopping = threading.Event()
+        self.lock = threading.Lock()
+        self.state = {'running': False, 'queued': False, 'runs': 0, 'last_started_at': None,
+                      'last_finished_at': None, 'last_result': None, 'failed_attachments': 0}
+        extractor.failed_attachments = set()
+    
+    def start(self, host='127.0.0.1', port=8765):
+        """Warm up the worker pool and start the HTTP endpoint (port None: poll only)"""
+        if self.pipelined:
+            self.extractor.start_worker_pool(self.pipeline_options.pop('cpu_workers', None))
+        else:
+            for engine in self.extractor.engines:
+                engine.load()
+        if port is not None:
+            self.server = ThreadingHTTPServer((host, port), _DaemonRequestHandler)
+            self.server.extractor_daemon = self
+            threading.Thread(target=self.server.serve_forever, name='daemon-http', daemon=True).start()
+            log.info(f"🛰️ Esperando ejecuciones en http://{host}:{self.server.server_port}/run")
+        if self.poll_seconds:
+            log.info(f"🛰️ Revisando registros pendientes cada {self.poll_seconds}s")
+    
+    def trigger(self, reason):
+        """Ask for a run; it starts as soon as the current one (if any) finishes"""
+        with self.lock:
+            self.state['queued'] = True
+        log.info(f"🔔 Ejecución solicitada ({reason})")
+        self.wakeup.set()
+    
+    def status(self):
+        with self.lock:
+            return dict(self.state)
+    
+    def authorized(self, header):
+        """Check the Authorization header against the token, if one is configured"""
+        if not self.token:
+            return True
+        return hmac.compare_digest((header or '').encode(), f"Bearer {self.token}".encode())
+    
+    def run_forever(self):
+        """Run on each trigger (and each poll interval) until stop() is called"""
+        while not self.stopping.is_set():
+            self.wakeup.wait(self.poll_seconds)
+            if self.stopping.is_set():
+                break
+            self.wakeup.clear()
+            self.run_once()
+    
+    def run_once(self):
+        """Process the pending records with the warm extractor"""
+        with self.lock:
+            self.state.update(running=True, queued=False,
+                              last_started_at=datetime.now().isoformat(timespec='seconds'))
+        result = None
+        try:
+            result = self.extractor.process_pending_records(*self.fields, pipelined=self.pipelined,
+                                                            **self.pipeline_options)
+        except Exception as e:
+            log.error(f"❌ Error en la ejecución del daemon: {e}")
+        finally:
+            with self.lock:
+                self.state.update(running=False, runs=self.state['runs'] + 1, last_result=result,
+                                  last_finished_at=datetime.now().isoformat(timespec='seconds'),
+                                  failed_attachments=len(self.extractor.failed_attachments))
+        return result
+    
+    def stop(self):
+        """Finish the current run, if any, and leave run_forever"""
+        self.stopping.set()
+        self.wakeup.set()
+    
+    def close(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+        self.extractor.close_worker_pool()
+
+class _DaemonRequestHandler(BaseHTTPRequestHandler):
+    """POST /run triggers a run, GET /status reports the daemon state (JSON)"""
+    def do_POST(self):
+        daemon = self.server.extractor_daemon
+        self.rfile.read(int(self.headers.get('Content-Length') or 0))  # The body is not used
+        if not daemon.authorized(self.headers.get('Authorization')):
+            return self._reply(401, {'success': False, 'error': 'No autorizado'})
+        if self.path.split('?')[0].rstrip('/') not in ('', '/run'):
+            return self._reply(404, {'success': False, 'error': 'No encontrado'})
+        daemon.trigger('http')
+        self._reply(202, {'success': True, 'queued': True, 'status': daemon.status()})
+    
+    def do_GET(self):
+        daemon = self.server.extractor_daemon
+        if not daemon.authorized(self.headers.get('Authorization')):
+            return self._reply(401, {'success': False, 'error': 'No autorizado'})
+        if self.path.split('?')[0].rstrip('/') != '/status':
+            return self._reply(404, {'success': False, 'error': 'No encontrado'})
+        self._reply(200, {'success': True, 'status': daemon.status()})
+    
+    def _reply(self, code, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def log_message(self, format, *args):
+        log.debug(f"🛰️ {self.address_string()} {format % args}")
 
 def main():
     """Main function"""
@@ -432,13 +2726,134 @@ def main():
     OUTPUT_FIELD_NAME = "CSV"
     STATUS_FIELD_NAME = "Estado_Procesamiento"
     
-    print("🔧 Initializing Improved PDF Extractor...")
+    # Pipeline configuration (PIPELINED=0 vuelve al procesamiento secuencial)
+    PIPELINED = os.getenv("PIPELINED", "1") == "1"
+    IO_WORKERS = int(os.getenv("IO_WORKERS", "4"))
+    CPU_WORKERS = int(os.getenv("CPU_WORKERS", "0")) or None
+    MAX_PENDING = int(os.getenv("MAX_PENDING", "0")) or None
+    
+    # Large PDFs: from PAGE_PARALLEL_THRESHOLD pages on (0 lo desactiva) a document is
+    # split into PAGE_WORKERS page ranges extracted in parallel (default: CPU count)
+    PAGE_PARALLEL_THRESHOLD = int(os.getenv("PAGE_PARALLEL_THRESHOLD", "200")) or None
+    PAGE_WORKERS = int(os.getenv("PAGE_WORKERS", "0")) or None
     
-    extractor = ImprovedPDFExtractor(AIRTABLE_API_KEY, BASE_ID, TABLE_NAME)
+    # Sharded runs: SHARD_COUNT workers (matrix jobs or local processes), each one
+    # processing the records of its SHARD_INDEX. Records are claimed with a lease of
+    # LEASE_SECONDS written to the LEASE_FIELD_NAME text field; leases are on by default
+    # only with several shards (RECORD_LEASES=1/0 lo fuerza).
+    SHARD_INDEX = int(os.getenv("SHARD_INDEX", "0"))
+    SHARD_COUNT = int(os.getenv("SHARD_COUNT", "1"))
+    RECORD_LEASES = os.getenv("RECORD_LEASES", "1" if SHARD_COUNT > 1 else "0") == "1"
+    LEASE_SECONDS = int(os.getenv("LEASE_SECONDS", "900"))
+    LEASE_FIELD_NAME = os.getenv("LEASE_FIELD_NAME", "Lease_Procesamiento")
+    shard_suffix = f".{SHARD_INDEX}" if SHARD_COUNT > 1 else ""
     
-    # Process all records, including ones that might need reprocessing
-    # Remove the filter to reprocess all records
-    extractor.process_all_records(PDF_FIELD_NAME, OUTPUT_FIELD_NAME, STATUS_FIELD_NAME)
+    # Attachment downloads: read timeout in seconds and retries per PDF
+    DOWNLOAD_TIMEOUT = float(os.getenv("DOWNLOAD_TIMEOUT", "60"))
+    DOWNLOAD_RETRIES = int(os.getenv("DOWNLOAD_RETRIES", "3"))
+    
+    # Incremental sync (INCREMENTAL=0 vuelve a leer toda la tabla)
+    INCREMENTAL = os.getenv("INCREMENTAL", "1") == "1"
+    CHECKPOINT_PATH = os.getenv("CHECKPOINT_PATH", f".sync_checkpoint{shard_suffix}.json")
+    
+    # Text extraction engine: 'fast' (PyPDF2 con fallback a pdfplumber por página) o 'pdfplumber'
+    TEXT_ENGINE = os.getenv("TEXT_ENGINE", "fast")
+    
+    # Extraction cache (PDF_CACHE_DIR vacío lo desactiva)
+    PDF_CACHE_DIR = os.getenv("PDF_CACHE_DIR", ".pdf_cache")
+    PDF_CACHE_MAX_MB = int(os.getenv("PDF_CACHE_MAX_MB", "500"))
+    
+    # Per-client totals for the dashboard (CLIENT_ROLLUPS_PATH vacío los desactiva).
+    # Sharded workers do not keep them: ROLLUPS_ONLY=1 applies the CSV stored since its
+    # previous pass once all shards finished.
+    CLIENT_ROLLUPS_PATH = os.getenv("CLIENT_ROLLUPS_PATH", ".client_rollups.json")
+    CLIENT_SUMMARY_TABLE_NAME = os.getenv("AIRTABLE_CLIENT_SUMMARY_TABLE_NAME", "")
+    REBUILD_CLIENT_ROLLUPS = os.getenv("REBUILD_CLIENT_ROLLUPS", "0") == "1"
+    ROLLUPS_ONLY = os.getenv("ROLLUPS_ONLY", "0") == "1"
+    
+    # Duplicate deliveries across documents (DELIVERY_INDEX_PATH vacío lo desactiva).
+    # Like the rollups, sharded workers leave it to the ROLLUPS_ONLY=1 pass.
+    DELIVERY_INDEX_PATH = os.getenv("DELIVERY_INDEX_PATH", ".delivery_index.sqlite")
+    REBUILD_DELIVERY_INDEX = os.getenv("REBUILD_DELIVERY_INDEX", "0") == "1"
+    
+    # Parquet export of every extracted record, partitioned by month (requires pyarrow;
+    # PARQUET_DIR vacío lo desactiva)
+    PARQUET_DIR = os.getenv("PARQUET_DIR", "")
+    REBUILD_PARQUET = os.getenv("REBUILD_PARQUET", "0") == "1"
+    
+    # Daemon mode: stay running with warm workers and process the pending records on
+    # each POST /run to DAEMON_HOST:DAEMON_PORT and/or every DAEMON_POLL_SECONDS
+    DAEMON = os.getenv("DAEMON", "0") == "1"
+    DAEMON_HOST = os.getenv("DAEMON_HOST", "127.0.0.1")
+    DAEMON_PORT = int(os.getenv("DAEMON_PORT", "8765")) or None
+    DAEMON_POLL_SECONDS = float(os.getenv("DAEMON_POLL_SECONDS", "0")) or None
+    DAEMON_TOKEN = os.getenv("DAEMON_TOKEN", "")
+    
+    # Logging (LOG_LEVEL=DEBUG muestra el detalle por página y por línea)
+    LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+    RUN_SUMMARY_PATH = os.getenv("RUN_SUMMARY_PATH", f"run_summary{shard_suffix}.json")
+    
+    logging.basicConfig(level=LOG_LEVEL, format="%(message)s", stream=sys.stdout)
+    
+    log.info("🔧 Initializing Improved PDF Extractor...")
+    
+    cache = PDFExtractionCache(PDF_CACHE_DIR, PDF_CACHE_MAX_MB * 1024 * 1024) if PDF_CACHE_DIR else None
+    checkpoint = SyncCheckpoint(CHECKPOINT_PATH) if INCREMENTAL else None
+    rollups = ClientRollups(CLIENT_ROLLUPS_PATH) if CLIENT_ROLLUPS_PATH and (SHARD_COUNT == 1 or ROLLUPS_ONLY) else None
+    delivery_index = None
+    if DELIVERY_INDEX_PATH and (SHARD_COUNT == 1 or ROLLUPS_ONLY):
+        if REBUILD_DELIVERY_INDEX and os.path.exists(DELIVERY_INDEX_PATH):
+            os.remove(DELIVERY_INDEX_PATH)
+        delivery_index = DeliveryIndex(DELIVERY_INDEX_PATH)
+    parquet_sink = None
+    if PARQUET_DIR:
+        seed_parquet = REBUILD_PARQUET or not os.path.isdir(PARQUET_DIR) or not os.listdir(PARQUET_DIR)
+        parquet_sink = ParquetDeliverySink(PARQUET_DIR)
+    downloader = AttachmentDownloader(pool_size=max(IO_WORKERS, 1), read_timeout=DOWNLOAD_TIMEOUT,
+                                      max_retries=DOWNLOAD_RETRIES)
+    extractor = ImprovedPDFExtractor(AIRTABLE_API_KEY, BASE_ID, TABLE_NAME, cache=cache, checkpoint=checkpoint,
+                                     engines=default_text_engines(TEXT_ENGINE), summary_path=RUN_SUMMARY_PATH or None,
+                                     rollups=rollups, summary_table_name=CLIENT_SUMMARY_TABLE_NAME or None,
+                                     downloader=downloader, shard_index=SHARD_INDEX, shard_count=SHARD_COUNT,
+                                     lease_seconds=LEASE_SECONDS if RECORD_LEASES else None,
+                                     lease_field_name=LEASE_FIELD_NAME,
+                                     page_parallel_threshold=PAGE_PARALLEL_THRESHOLD, page_workers=PAGE_WORKERS,
+                                     delivery_index=delivery_index, parquet_sink=parquet_sink)
+    if SHARD_COUNT > 1:
+        log.info(f"🧩 Shard {SHARD_INDEX + 1}/{SHARD_COUNT} (worker {extractor.worker_id})")
+    
+    # Seed the client rollups and the delivery index, or apply the CSV stored since their
+    # previous pass (after sharded runs, or when the state files come from an older run)
+    extractor.sync_stored_documents(PDF_FIELD_NAME, OUTPUT_FIELD_NAME, STATUS_FIELD_NAME,
+                                    full=REBUILD_CLIENT_ROLLUPS)
+    if parquet_sink is not None and seed_parquet:
+        extractor.rebuild_parquet_dataset(PDF_FIELD_NAME, OUTPUT_FIELD_NAME, STATUS_FIELD_NAME)
+    if ROLLUPS_ONLY:
+        return
+    
+    # Process pending records only, or all records when INCREMENTAL=0
+    pipeline_options = {'io_workers': IO_WORKERS, 'cpu_workers': CPU_WORKERS, 'max_pending': MAX_PENDING}
+    if DAEMON:
+        daemon = ExtractorDaemon(extractor, PDF_FIELD_NAME, OUTPUT_FIELD_NAME, STATUS_FIELD_NAME,
+                                 pipelined=PIPELINED, pipeline_options=pipeline_options,
+                                 poll_seconds=DAEMON_POLL_SECONDS, token=DAEMON_TOKEN or None)
+        signal.signal(signal.SIGTERM, lambda signum, frame: daemon.stop())
+        daemon.start(DAEMON_HOST, DAEMON_PORT)
+        daemon.trigger('inicio')
+        try:
+            daemon.run_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            daemon.close()
+    elif INCREMENTAL:
+        extractor.process_pending_records(PDF_FIELD_NAME, OUTPUT_FIELD_NAME, STATUS_FIELD_NAME,
+                                          pipelined=PIPELINED, **pipeline_options)
+    elif PIPELINED:
+        extractor.process_all_records_pipelined(PDF_FIELD_NAME, OUTPUT_FIELD_NAME, STATUS_FIELD_NAME,
+                                                **pipeline_options)
+    else:
+        extractor.process_all_records(PDF_FIELD_NAME, OUTPUT_FIELD_NAME, STATUS_FIELD_NAME)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
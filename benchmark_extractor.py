@@ -0,0 +1,312 @@
+"""
+Benchmark suite for airtable_pdf_extractor
+
+Generates synthetic GruSIMPA delivery reports (client headers, Remito and
+Orden de Retiro rows, DD-Mmm.-YY dates) as text and as PDFs, and times each
+processing stage separately without touching Airtable:
+
+    extract         extract_text_from_pdf           pages/sec
+    parse_advanced  parse_delivery_data_advanced    lines/sec, records/sec
+    parse_simple    parse_simple_table_data         lines/sec, records/sec
+    csv             convert_to_csv_string           records/sec
+    end_to_end      process_pdf_content             pages/sec, records/sec
+
+Each measurement runs in a fresh process so peak RSS is reported per stage.
+
+--corpus checks parse_delivery_data_advanced against the regression corpus in
+tests/regression (report text <name>.txt and the CSV the original parser wrote for it,
+<name>.csv) and reports its lines/sec; any difference fails the run.
+
+Usage:
+    python benchmark_extractor.py --sizes 1,10,100,1000
+    python benchmark_extractor.py --save-baseline benchmark_baseline.json
+    python benchmark_extractor.py --compare benchmark_baseline.json
+    python benchmark_extractor.py --corpus
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import resource
+import contextlib
+import multiprocessing
+
+STAGES = ['extract', 'parse_advanced', 'parse_simple', 'csv', 'end_to_end']
+
+REGRESSION_CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tests', 'regression')
+
+MONTHS = ['Ene', 'Feb', 'Mar', 'Abr', 'May', 'Jun', 'Jul', 'Ago', 'Sep', 'Oct', 'Nov', 'Dic']
+CHOFERES = ['PEREZ JUAN', 'GOMEZ CARLOS A.', 'RODRIGUEZ-LOPEZ M.', 'FERNANDEZ LUIS', 'DIAZ PABLO']
+LOCALIDADES = ['SAN MIGUEL', 'BAHIA BLANCA (BA)', 'MAR DEL PLATA', 'ROSARIO, SANTA FE', 'LA PLATA']
+CLIENTES = ['DISTRIBUIDORA DEL SUR SRL', 'ALIMENTOS LA PAMPA SA', 'MAYORISTA NORTE', 'SUPERMERCADOS ROCA',
+            'COOPERATIVA AGRICOLA UNION', 'ALMACEN DON PEDRO']
+
+def generate_report_pages(pages, rows_per_page=40, seed=0):
+    """
+    Generate the lines of a synthetic GruSIMPA report, one list per page
+    Each page has a header, client header lines followed by their deliveries
+    (mixing Remito and Orden de Retiro rows) and a page footer
+    """
+    rng = random.Random(seed)
+    report = []
+    for page_number in range(1, pages + 1):
+        lines = ["GruSIMPA - Listado de entregas por cliente",
+                 "Fecha Transac Documento Viaje Chofer Localidad Bultos Cant. Neto Bruto"]
+        for row in range(rows_per_page):
+            # A new client every few rows; clients also continue across pages
+            if (row == 0 and page_number == 1) or rng.random() < 0.15:
+                lines.append(f"{rng.randint(100, 99999)} {rng.choice(CLIENTES)}")
+            document = rng.choice(['Remito', 'Remito', 'Remito', 'Orden de Retiro'])
+            lines.append(
+                f"{rng.randint(1, 28):02d}-{rng.choice(MONTHS)}.-{rng.randint(22, 25)} "
+                f"{rng.randint(100000, 999999)} {document}{rng.randint(10000, 99999)} "
+                f"{rng.randint(1000, 9999)} {rng.randint(10, 999)} {rng.choice(CHOFERES)} "
+                f"{rng.choice(LOCALIDADES)} {rng.randint(1, 80)} {rng.randint(1, 900)} "
+                f"{rng.randint(50, 25000)}.{rng.randint(0, 99):02d} {rng.randint(50, 26000)}.{rng.randint(0, 99):02d}"
+            )
+        lines.append(f"Página {page_number} de {pages}")
+        report.append(lines)
+    return report
+
+def generate_report_text(pages, rows_per_page=40, seed=0):
+    """Synthetic report as the text extract_text_from_pdf returns"""
+    report = generate_report_pages(pages, rows_per_page, seed)
+    return "\n\n".join("\n".join(lines) for lines in report)
+
+def _pdf_escape(text):
+    return text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+def generate_report_pdf(pages, rows_per_page=40, seed=0):
+    """Synthetic report as a PDF, one text line per report line (Helvetica, WinAnsi)"""
+    return report_pages_pdf(generate_report_pages(pages, rows_per_page, seed))
+
+def report_pages_pdf(report):
+    """PDF with one page per list of lines in report"""
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        None,  # Pages, filled once the page ids are known
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>",
+    ]
+    page_ids = []
+    for lines in report:
+        operations = ["BT /F1 7 Tf 20 820 Td 9 TL"]
+        operations.extend(f"({_pdf_escape(line)}) Tj T*" for line in lines)
+        operations.append("ET")
+        stream = "\n".join(operations).encode('cp1252')
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        objects.append(b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 842 842] "
+                       b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % len(objects))
+        page_ids.append(len(objects))
+    kids = b" ".join(b"%d 0 R" % page_id for page_id in page_ids)
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, len(page_ids))
+
+    output = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(output))
+        output += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref_offset = len(output)
+    output += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    output += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    output += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref_offset)
+    return bytes(output)
+
+def _peak_rss_mb():
+    # ru_maxrss is in KB on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+def _run_stage(stage, pages, rows_per_page, engine, repeat, queue, page_workers=None):
+    """Run one stage in a fresh process and report its best time over repeat runs"""
+    from airtable_pdf_extractor import ImprovedPDFExtractor, default_text_engines
+
+    # With page_workers, end_to_end splits every document into page ranges
+    extractor = ImprovedPDFExtractor('benchmark', 'benchmark', 'benchmark', engines=default_text_engines(engine),
+                                     page_parallel_threshold=1 if page_workers else None,
+                                     page_workers=page_workers)
+    text_content = generate_report_text(pages, rows_per_page)
+    pdf_content = generate_report_pdf(pages, rows_per_page) if stage in ('extract', 'end_to_end') else None
+    line_count = text_content.count('\n') + 1
+
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        records = extractor.parse_delivery_data_advanced(text_content) if stage == 'csv' else None
+        rss_before = _peak_rss_mb()
+        seconds = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            if stage == 'extract':
+                extractor.extract_text_from_pdf(pdf_content)
+                record_count = 0
+            elif stage == 'parse_advanced':
+                record_count = len(extractor.parse_delivery_data_advanced(text_content))
+            elif stage == 'parse_simple':
+                record_count = len(extractor.parse_simple_table_data(text_content))
+            elif stage == 'csv':
+                extractor.convert_to_csv_string(records)
+                record_count = len(records)
+            else:
+                output = extractor.process_pdf_content(pdf_content)
+                record_count = int(output.rsplit('REGISTROS ENCONTRADOS:', 1)[-1].split()[0]) \
+                    if 'REGISTROS ENCONTRADOS:' in output else 0
+            elapsed = time.perf_counter() - start
+            seconds = elapsed if seconds is None else min(seconds, elapsed)
+
+    result = {'stage': stage, 'pages': pages, 'seconds': seconds, 'records': record_count,
+              'peak_rss_mb': _peak_rss_mb(), 'rss_growth_mb': _peak_rss_mb() - rss_before}
+    if stage in ('extract', 'end_to_end'):
+        result['pages_per_sec'] = pages / seconds
+    if stage in ('parse_advanced', 'parse_simple'):
+        result['lines_per_sec'] = line_count / seconds
+    if stage != 'extract':
+        result['records_per_sec'] = record_count / seconds
+    extractor._close_page_pool()
+    queue.put(result)
+
+def run_benchmarks(sizes, stages=STAGES, rows_per_page=40, engine='fast', repeat=3, page_workers=None):
+    """Run every stage for every document size, each in its own process"""
+    context = multiprocessing.get_context('spawn')
+    results = []
+    for pages in sizes:
+        for stage in stages:
+            queue = context.Queue()
+            process = context.Process(target=_run_stage,
+                                      args=(stage, pages, rows_per_page, engine, repeat, queue, page_workers))
+            process.start()
+            result = queue.get()
+            process.join()
+            results.append(result)
+            print_result(result)
+    return results
+
+def _rate(result):
+    """Main throughput figure of a result"""
+    for key in ('pages_per_sec', 'lines_per_sec', 'records_per_sec'):
+        if key in result:
+            return key, result[key]
+
+def print_result(result):
+    key, value = _rate(result)
+    print(f"{result['stage']:<15} {result['pages']:>5} págs  {result['seconds']:>8.3f}s  "
+          f"{value:>12,.0f} {key.replace('_per_sec', '/s'):<10} "
+          f"{result['records']:>7} registros  pico RSS {result['peak_rss_mb']:.0f} MB "
+          f"(+{result['rss_growth_mb']:.0f})")
+
+def check_corpus(corpus_dir=REGRESSION_CORPUS, repeat=3):
+    """
+    Parse every report of the regression corpus and compare the CSV with the expected one
+    Returns one result per report, with 'mismatch' set to (line number, expected, got)
+    at the first differing CSV line
+    """
+    from airtable_pdf_extractor import ImprovedPDFExtractor
+
+    extractor = ImprovedPDFExtractor('benchmark', 'benchmark', 'benchmark')
+    results = []
+    for name in sorted(os.listdir(corpus_dir)):
+        if not name.endswith('.txt'):
+            continue
+        with open(os.path.join(corpus_dir, name), 'r', encoding='utf-8', newline='') as f:
+            text_content = f.read()
+        with open(os.path.join(corpus_dir, name[:-4] + '.csv'), 'r', encoding='utf-8', newline='') as f:
+            expected = f.read().splitlines()
+
+        seconds = None
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            for _ in range(repeat):
+                start = time.perf_counter()
+                records = extractor.parse_delivery_data_advanced(text_content)
+                elapsed = time.perf_counter() - start
+                seconds = elapsed if seconds is None else min(seconds, elapsed)
+            got = extractor.convert_to_csv_string(records).splitlines()
+
+        mismatch = None
+        if got != expected:
+            line = next((i for i, (a, b) in enumerate(zip(expected, got)) if a != b), min(len(expected), len(got)))
+            mismatch = (line + 1, expected[line] if line < len(expected) else None, got[line] if line < len(got) else None)
+        line_count = text_content.count('\n') + 1
+        results.append({'name': name[:-4], 'lines': line_count, 'records': len(records), 'seconds': seconds,
+                        'lines_per_sec': line_count / seconds, 'mismatch': mismatch})
+    return results
+
+def compare_with_baseline(results, baseline, tolerance):
+    """
+    Compare throughput and peak RSS against a saved baseline
+    Returns the list of regressions beyond tolerance (e.g. 0.2 = 20%)
+    """
+    saved = {(r['stage'], r['pages']): r for r in baseline['results']}
+    regressions = []
+    print(f"\n📊 Comparación con baseline ({baseline.get('created_at', '?')})")
+    for result in results:
+        previous = saved.get((result['stage'], result['pages']))
+        if previous is None:
+            continue
+        key, value = _rate(result)
+        change = value / previous[key] - 1
+        rss_change = result['rss_growth_mb'] - previous['rss_growth_mb']
+        regressed = change < -tolerance or rss_change > max(tolerance * previous['rss_growth_mb'], 10)
+        mark = '❌' if regressed else '✅'
+        print(f"{mark} {result['stage']:<15} {result['pages']:>5} págs  {change:+.1%} {key.replace('_per_sec', '/s')}"
+              f"  RSS {rss_change:+.0f} MB")
+        if regressed:
+            regressions.append(result)
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de las etapas del extractor de PDFs")
+    parser.add_argument('--sizes', default='1,10,100', help="Páginas por documento, separadas por coma (máx. 1000)")
+    parser.add_argument('--stages', default=','.join(STAGES), help="Etapas a medir, separadas por coma")
+    parser.add_argument('--rows-per-page', type=int, default=40)
+    parser.add_argument('--repeat', type=int, default=3, help="Repeticiones por medición (se toma la mejor)")
+    parser.add_argument('--engine', default='fast', choices=['fast', 'pdfplumber'], help="Motor de extracción")
+    parser.add_argument('--page-workers', type=int, default=0,
+                        help="Procesos por documento en end_to_end (0 = extracción secuencial)")
+    parser.add_argument('--save-baseline', metavar='PATH', help="Guardar los resultados como baseline")
+    parser.add_argument('--compare', metavar='PATH', help="Comparar contra un baseline guardado")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="Regresión tolerada (0.2 = 20%%)")
+    parser.add_argument('--json', metavar='PATH', help="Guardar los resultados en JSON")
+    parser.add_argument('--corpus', nargs='?', const=REGRESSION_CORPUS, metavar='DIR',
+                        help="Comparar el parser contra el corpus de regresión (por defecto tests/regression)")
+    args = parser.parse_args()
+
+    if args.corpus:
+        results = check_corpus(args.corpus, args.repeat)
+        for result in results:
+            mark = '❌' if result['mismatch'] else '✅'
+            print(f"{mark} {result['name']:<15} {result['lines']:>6} líneas  {result['records']:>6} registros  "
+                  f"{result['lines_per_sec']:>12,.0f} líneas/s")
+            if result['mismatch']:
+                line, expected, got = result['mismatch']
+                print(f"   línea {line} del CSV\n   esperado: {expected}\n   obtenido: {got}")
+        if not results or any(result['mismatch'] for result in results):
+            sys.exit(1)
+        return
+
+    sizes = [int(size) for size in args.sizes.split(',')]
+    stages = [stage for stage in args.stages.split(',') if stage]
+    unknown = set(stages) - set(STAGES)
+    if unknown or any(size < 1 or size > 1000 for size in sizes):
+        parser.error(f"Etapas válidas: {', '.join(STAGES)}; tamaños entre 1 y 1000 páginas")
+
+    print(f"🏁 Benchmark: {len(stages)} etapas x {len(sizes)} tamaños (motor: {args.engine})")
+    results = run_benchmarks(sizes, stages, args.rows_per_page, args.engine, args.repeat, args.page_workers or None)
+    report = {'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'), 'engine': args.engine,
+              'rows_per_page': args.rows_per_page, 'page_workers': args.page_workers, 'results': results}
+
+    for path in (args.json, args.save_baseline):
+        if path:
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(report, f, indent=2)
+            print(f"💾 Resultados guardados en {path}")
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare_with_baseline(results, baseline, args.tolerance)
+        if regressions:
+            print(f"❌ {len(regressions)} regresiones")
+            sys.exit(1)
+        print("✅ Sin regresiones")
+
+if __name__ == "__main__":
+    main()
@@ -20,6 +20,27 @@ interface ClientData {
   documentosInfo: string[];
   fechaUltima: string;
   estado: string; // Nuevo campo para el estado
+  segmento: string | null; // 'chica' | 'mediana' | 'grande', o null por debajo de 1000 kg
+}
+
+// Totales de un cliente mientras se recalculan desde los CSV (localidades sin unir,
+// porque una localidad puede tener coma)
+interface ClientTotals extends ClientData {
+  localidades: string[];
+}
+
+interface ClientSummaryRecord {
+  id: string;
+  fields: {
+    Cliente_Nombre?: string;
+    Localidad?: string;
+    Kg_Total?: number;
+    Viajes?: number;
+    Documentos?: number;
+    Documentos_Info?: string;
+    Fecha_Ultima?: string;
+    Segmento?: string;
+  };
 }
 
 interface ApiResponse {
@@ -39,47 +60,203 @@ interface ApiResponse {
   };
 }
 
-function extractClientInfo(csvContent: string, filename: string): ClientData[] {
-  const clients: ClientData[] = [];
+// Mismas definiciones que los totales por cliente del procesador (client_totals y
+// ClientRollups en airtable_pdf_extractor.py), para que el recálculo desde los CSV
+// muestre los mismos números que la tabla de totales
+
+// Segmentos por kg total, de mayor a menor (CLIENT_SEGMENTS del procesador)
+const CLIENT_SEGMENTS: [string, number][] = [['grande', 12000], ['mediana', 7000], ['chica', 1000]];
+
+const REPORT_MONTHS: Record<string, number> = {
+  ene: 1, feb: 2, mar: 3, abr: 4, may: 5, jun: 6,
+  jul: 7, ago: 8, sep: 9, set: 9, oct: 10, nov: 11, dic: 12
+};
+
+// Fecha del reporte como '09-Sep.-25' a ISO ('2025-09-09'), o null si no se puede leer
+function parseReportDate(fecha: string): string | null {
+  const match = /^(\d{2})-(\w{3})\.?-?(\d{2})$/.exec(fecha.trim());
+  const month = match ? REPORT_MONTHS[match[2].toLowerCase()] : undefined;
+  if (!match || !month) return null;
+  const year = 2000 + Number(match[3]);
+  const day = Number(match[1]);
+  const parsed = new Date(Date.UTC(year, month - 1, day));
+  if (parsed.getUTCMonth() !== month - 1) return null;
+  return parsed.toISOString().slice(0, 10);
+}
+
+function clientSegment(kgTotal: number): string | null {
+  const segment = CLIENT_SEGMENTS.find(([, minimum]) => kgTotal >= minimum);
+  return segment ? segment[0] : null;
+}
+
+// Separa una línea CSV respetando los campos entre comillas (localidades con coma)
+function splitCsvLine(line: string): string[] {
+  const values: string[] = [];
+  let value = '';
+  let quoted = false;
+  for (let i = 0; i < line.length; i++) {
+    const char = line[i];
+    if (quoted) {
+      if (char === '"' && line[i + 1] === '"') {
+        value += '"';
+        i++;
+      } else if (char === '"') {
+        quoted = false;
+      } else {
+        value += char;
+      }
+    } else if (char === '"') {
+      quoted = true;
+    } else if (char === ',') {
+      values.push(value);
+      value = '';
+    } else {
+      value += char;
+    }
+  }
+  values.push(value);
+  return values;
+}
+
+// Totales por cliente de un documento: viajes distintos, una sola vez el documento
+function extractClientInfo(csvContent: string, filename: string): ClientTotals[] {
+  const clients = new Map<string, ClientTotals>();
+  const viajesPorCliente = new Map<string, Set<string>>();
   
   try {
     // Parsear CSV
     const lines = csvContent.split('\n');
-    const headers = lines[0]?.split(',') || [];
+    const headers = lines[0] ? splitCsvLine(lines[0]) : [];
     
     for (let i = 1; i < lines.length; i++) {
-      const line = lines[i];
+      const line = lines[i].replace(/\r$/, '');
       if (!line.trim()) continue;
       
-      const values = line.split(',');
+      const values = splitCsvLine(line);
       if (values.length < headers.length) continue;
       
-      const clienteNombre = values[6]?.replace(/"/g, '').trim();
-      const localidad = values[7]?.replace(/"/g, '').trim();
+      const clienteNombre = values[6]?.trim();
+      const localidad = values[7]?.trim();
       const pesoNeto = parseFloat(values[11] || '0');
+      if (!clienteNombre || !(pesoNeto > 0)) continue;
       
-      if (clienteNombre && pesoNeto > 0) {
-        clients.push({
+      const fecha = parseReportDate(values[0] || '');
+      const existing = clients.get(clienteNombre);
+      if (!existing) {
+        clients.set(clienteNombre, {
           nombre: clienteNombre,
-          localidad: localidad || 'Sin localidad',
+          localidad: '',
+          localidades: localidad ? [localidad] : [],
           kgTotal: pesoNeto,
-          viajes: 1,
+          viajes: 0,
           documentos: 1,
-          fechaUltima: values[0]?.replace(/"/g, '').trim() || 'Sin fecha',
+          fechaUltima: fecha || '',
           documentosInfo: [filename],
-          estado: 'Pendiente' // Estado por defecto
+          estado: 'Pendiente', // Estado por defecto
+          segmento: null
         });
+        viajesPorCliente.set(clienteNombre, new Set([values[1]?.trim() || '']));
+        continue;
+      }
+      existing.kgTotal += pesoNeto;
+      viajesPorCliente.get(clienteNombre)?.add(values[1]?.trim() || '');
+      if (fecha && fecha > existing.fechaUltima) {
+        existing.fechaUltima = fecha;
+      }
+      if (localidad && !existing.localidades.includes(localidad)) {
+        existing.localidades.push(localidad);
       }
     }
   } catch (error) {
     console.error('Error parsing CSV:', error);
   }
   
-  return clients;
+  clients.forEach((client, nombre) => {
+    client.kgTotal = Math.round(client.kgTotal * 100) / 100;
+    client.viajes = viajesPorCliente.get(nombre)?.size || 0;
+  });
+  return Array.from(clients.values());
+}
+
+function buildResponse(clientes: ClientData[]): ApiResponse {
+  const clientesAnalizados = clientes.sort((a, b) => b.kgTotal - a.kgTotal);
+  
+  // Segmentación (calculada por el procesador, columna Segmento)
+  const cuentasChicas = clientesAnalizados.filter(c => c.segmento === 'chica');
+  const cuentasMedianas = clientesAnalizados.filter(c => c.segmento === 'mediana');
+  const cuentasGrandes = clientesAnalizados.filter(c => c.segmento === 'grande');
+  
+  const totalKg = clientesAnalizados.reduce((sum, c) => sum + c.kgTotal, 0);
+  const promedioKg = clientesAnalizados.length > 0 ? totalKg / clientesAnalizados.length : 0;
+  
+  return {
+    clientesAnalizados,
+    resumen: {
+      totalClientes: clientesAnalizados.length,
+      totalKg,
+      promedioKg,
+      cuentasChicas: cuentasChicas.length,
+      cuentasMedianas: cuentasMedianas.length,
+      cuentasGrandes: cuentasGrandes.length
+    },
+    segmentacion: {
+      cuentasChicas,
+      cuentasMedianas,
+      cuentasGrandes
+    }
+  };
+}
+
+// Totales precalculados por el procesador de PDFs (tabla de totales por cliente)
+function summaryToClientData(records: ClientSummaryRecord[], estadosMap: Map<string, string>): ClientData[] {
+  return records
+    .filter(record => record.fields.Cliente_Nombre && (record.fields.Kg_Total || 0) > 0)
+    .map(record => {
+      const nombre = record.fields.Cliente_Nombre as string;
+      return {
+        nombre,
+        localidad: record.fields.Localidad || 'Sin localidad',
+        kgTotal: record.fields.Kg_Total || 0,
+        viajes: record.fields.Viajes || 0,
+        documentos: record.fields.Documentos || 0,
+        documentosInfo: (record.fields.Documentos_Info || '').split('\n').filter(Boolean),
+        fechaUltima: record.fields.Fecha_Ultima || 'Sin fecha',
+        estado: estadosMap.get(nombre) || 'Pendiente',
+        segmento: record.fields.Segmento || null
+      };
+    });
+}
+
+async function fetchAllRecords<T>(baseId: string, tableName: string, apiKey: string): Promise<T[]> {
+  const records: T[] = [];
+  let offset: string | undefined;
+  
+  do {
+    const url = new URL(`https://api.airtable.com/v0/${baseId}/${encodeURIComponent(tableName)}`);
+    if (offset) {
+      url.searchParams.set('offset', offset);
+    }
+    const response = await fetch(url.toString(), {
+      headers: {
+        'Authorization': `Bearer ${apiKey}`,
+        'Content-Type': 'application/json',
+      },
+    });
+    
+    if (!response.ok) {
+      throw new Error(`Airtable API error: ${response.status}`);
+    }
+    
+    const data = await response.json();
+    records.push(...(data.records || []));
+    offset = data.offset;
+  } while (offset);
+  
+  return records;
 }
 
 function analyzeClientData(records: AirtableRecord[], estadosMap: Map<string, string> = new Map()): ApiResponse {
-  const clientesMap = new Map<string, ClientData>();
+  const clientesMap = new Map<string, ClientTotals>();
   
   records.forEach((record: AirtableRecord) => {
     const csvContent = record.fields.CSV;
@@ -98,17 +275,17 @@ function analyzeClientData(records: AirtableRecord[], estadosMap: Map<string, st
         existing.kgTotal += client.kgTotal;
         existing.viajes += client.viajes;
         existing.documentos += 1;
-        if (!existing.documentosInfo.includes(filename)) {
-          existing.documentosInfo.push(filename);
-        }
-        // Actualizar fecha si es más reciente
-        if (client.fechaUltima && existing.fechaUltima && client.fechaUltima > existing.fechaUltima) {
+        existing.documentosInfo.push(filename);
+        // Actualizar fecha si es más reciente (fechas ISO, se comparan como texto)
+        if (client.fechaUltima > existing.fechaUltima) {
           existing.fechaUltima = client.fechaUltima;
         }
         // Combinar localidades únicas
-        if (client.localidad && !existing.localidad.includes(client.localidad)) {
-          existing.localidad = existing.localidad + ', ' + client.localidad;
-        }
+        client.localidades.forEach(localidad => {
+          if (!existing.localidades.includes(localidad)) {
+            existing.localidades.push(localidad);
+          }
+        });
       } else {
         // Usar el estado guardado en Airtable o 'Pendiente' por defecto
         const estadoGuardado = estadosMap.get(clienteKey) || 'Pendiente';
@@ -120,33 +297,17 @@ function analyzeClientData(records: AirtableRecord[], estadosMap: Map<string, st
     });
   });
   
-  const clientesAnalizados = Array.from(clientesMap.values())
-    .sort((a, b) => b.kgTotal - a.kgTotal);
-  
-  // Segmentación
-  const cuentasChicas = clientesAnalizados.filter(c => c.kgTotal >= 1000 && c.kgTotal < 7000);
-  const cuentasMedianas = clientesAnalizados.filter(c => c.kgTotal >= 7000 && c.kgTotal < 12000);
-  const cuentasGrandes = clientesAnalizados.filter(c => c.kgTotal >= 12000);
-  
-  const totalKg = clientesAnalizados.reduce((sum, c) => sum + c.kgTotal, 0);
-  const promedioKg = clientesAnalizados.length > 0 ? totalKg / clientesAnalizados.length : 0;
-  
-  return {
-    clientesAnalizados,
-    resumen: {
-      totalClientes: clientesAnalizados.length,
-      totalKg,
-      promedioKg,
-      cuentasChicas: cuentasChicas.length,
-      cuentasMedianas: cuentasMedianas.length,
-      cuentasGrandes: cuentasGrandes.length
-    },
-    segmentacion: {
-      cuentasChicas,
-      cuentasMedianas,
-      cuentasGrandes
-    }
-  };
+  const clientes = Array.from(clientesMap.values()).map(({ localidades, ...client }) => {
+    const kgTotal = Math.round(client.kgTotal * 100) / 100;
+    return {
+      ...client,
+      kgTotal,
+      localidad: localidades.join(', ') || 'Sin localidad',
+      fechaUltima: client.fechaUltima || 'Sin fecha',
+      segmento: clientSegment(kgTotal)
+    };
+  });
+  return buildResponse(clientes);
 }
 
 export async function GET() {
@@ -155,6 +316,7 @@ export async function GET() {
     const baseId = process.env.AIRTABLE_BASE_ID;
     const tableName = process.env.AIRTABLE_TABLE_NAME;
     const statesTableName = process.env.AIRTABLE_CLIENT_STATES_TABLE_NAME;
+    const summaryTableName = process.env.AIRTABLE_CLIENT_SUMMARY_TABLE_NAME;
 
     if (!apiKey || !baseId || !tableName) {
       return NextResponse.json(
@@ -163,24 +325,6 @@ export async function GET() {
       );
     }
 
-    // Cargar datos principales
-    const response = await fetch(
-      `https://api.airtable.com/v0/${baseId}/${encodeURIComponent(tableName)}`,
-      {
-        headers: {
-          'Authorization': `Bearer ${apiKey}`,
-          'Content-Type': 'application/json',
-        },
-      }
-    );
-
-    if (!response.ok) {
-      throw new Error(`Airtable API error: ${response.status}`);
-    }
-
-    const data = await response.json();
-    const records: AirtableRecord[] = data.records || [];
-
     // Cargar estados desde la tabla separada
     const estadosMap = new Map<string, string>();
     if (statesTableName) {
@@ -212,6 +356,18 @@ export async function GET() {
       }
     }
     
+    // Usar los totales precalculados por el procesador si están disponibles
+    if (summaryTableName) {
+      try {
+        const summaryRecords = await fetchAllRecords<ClientSummaryRecord>(baseId, summaryTableName, apiKey);
+        return NextResponse.json(buildResponse(summaryToClientData(summaryRecords, estadosMap)));
+      } catch (error) {
+        console.error('Error cargando totales por cliente, se recalculan desde los CSV:', error);
+      }
+    }
+
+    // Cargar datos principales (todas las páginas, como la tabla de totales)
+    const records = await fetchAllRecords<AirtableRecord>(baseId, tableName, apiKey);
     const result = analyzeClientData(records, estadosMap);
     
     return NextResponse.json(result);
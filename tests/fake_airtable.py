@@ -0,0 +1,118 @@
+"""
+In-memory stand-ins for Airtable, to run the extractor in tests without network access
+
+FakeTable implements the pyairtable Table calls the extractor makes. Formulas are only
+interpreted for RECORD_ID() lookups; any other formula is recorded in `formulas` and
+returns every record, which the extractor filters again on its side anyway.
+"""
+import re
+import copy
+import threading
+from collections import Counter
+
+import airtable_pdf_extractor as extractor_module
+from benchmark_extractor import generate_report_pdf
+
+class FakeTable:
+    def __init__(self, records=()):
+        self.records = {record['id']: copy.deepcopy(record) for record in records}
+        self.lock = threading.Lock()
+        self.formulas = []
+        self.calls = Counter()
+        self.status_writes = Counter()
+    
+    def _select(self, formula=None, fields=None):
+        with self.lock:
+            records = [copy.deepcopy(record) for record in self.records.values()]
+        if formula and 'RECORD_ID()' in formula:
+            ids = set(re.findall(r"RECORD_ID\(\) = '([^']+)'", formula))
+            records = [record for record in records if record['id'] in ids]
+        elif formula:
+            self.formulas.append(formula)
+        if fields:
+            for record in records:
+                record['fields'] = {name: value for name, value in record['fields'].items() if name in fields}
+        return records
+    
+    def iterate(self, formula=None, fields=None, page_size=100):
+        self.calls['iterate'] += 1
+        records = self._select(formula, fields)
+        for start in range(0, len(records), page_size):
+            yield records[start:start + page_size]
+    
+    def all(self, formula=None, fields=None):
+        self.calls['all'] += 1
+        return self._select(formula, fields)
+    
+    def get(self, record_id):
+        self.calls['get'] += 1
+        with self.lock:
+            return copy.deepcopy(self.records[record_id])
+    
+    def _write(self, record_id, fields):
+        record_fields = self.records[record_id]['fields']
+        for name, value in fields.items():
+            if value is None:
+                record_fields.pop(name, None)  # Airtable drops empty fields
+            else:
+                record_fields[name] = value
+        if 'Estado_Procesamiento' in fields:
+            self.status_writes[record_id] += 1
+    
+    def update(self, record_id, fields):
+        self.calls['update'] += 1
+        with self.lock:
+            self._write(record_id, fields)
+    
+    def batch_update(self, records):
+        self.calls['batch_update'] += 1
+        assert len(records) <= 10, "Airtable accepts at most 10 records per request"
+        with self.lock:
+            for record in records:
+                self._write(record['id'], record['fields'])
+    
+    def batch_upsert(self, records, key_fields):
+        self.calls['batch_upsert'] += 1
+        with self.lock:
+            for record in records:
+                key = tuple(record['fields'][name] for name in key_fields)
+                match = next((existing for existing in self.records.values()
+                              if tuple(existing['fields'].get(name) for name in key_fields) == key), None)
+                if match is None:
+                    record_id = f"rec{len(self.records):05d}"
+                    self.records[record_id] = {'id': record_id, 'fields': {}}
+                    match = self.records[record_id]
+                self._write(match['id'], record['fields'])
+
+class FakeDownloader:
+    """Serves PDFs from a dict by URL; unknown URLs fail like a broken attachment"""
+    def __init__(self, pdfs):
+        self.pdfs = pdfs
+        self.metrics = None
+        self.requests = Counter()
+    
+    def download(self, url, refresh=None):
+        self.requests[url] += 1
+        return self.pdfs.get(url)
+    
+    def close(self):
+        pass
+
+def document_records(count, status='Pendiente', pages=1, rows_per_page=12):
+    """Records with one synthetic report attached each, and the PDFs to serve for them"""
+    records, pdfs = [], {}
+    for i in range(count):
+        url = f"https://fake.airtable/doc{i}.pdf"
+        pdfs[url] = generate_report_pdf(pages, rows_per_page, seed=i)
+        fields = {'Documento': [{'id': f"att{i}", 'url': url, 'filename': f"reporte{i}.pdf"}]}
+        if status:
+            fields['Estado_Procesamiento'] = status
+        records.append({'id': f"rec{i:03d}", 'fields': fields})
+    return records, pdfs
+
+def fake_extractor(table, pdfs, **options):
+    """ImprovedPDFExtractor working on a FakeTable, downloading from FakeDownloader"""
+    extractor = extractor_module.ImprovedPDFExtractor('key', 'appFake', 'Documentos',
+                                                      downloader=FakeDownloader(pdfs), **options)
+    extractor.table = table
+    return extractor
@@ -0,0 +1,86 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import airtable_pdf_extractor as extractor_module
+
+PDF = b"%PDF-1.4\n" + bytes(range(256)) * 1024 + b"\n%%EOF\n"
+
+class _StandInHandler(BaseHTTPRequestHandler):
+    """Attachment server: /ok serves PDF, other paths fail in the way their name says"""
+    def do_GET(self):
+        server = self.server
+        server.hits[self.path] = server.hits.get(self.path, 0) + 1
+        if self.path == '/flaky' and server.hits[self.path] <= 2:
+            self.send_error(503)
+        elif self.path == '/expired':
+            self.send_error(410)
+        elif self.path == '/missing':
+            self.send_error(404)
+        elif self.path == '/slow' and server.hits[self.path] == 1:
+            time.sleep(0.5)
+            self._send(PDF)
+        elif self.path in ('/ok', '/flaky', '/slow'):
+            self._send(PDF)
+        else:
+            self.send_error(404)
+    
+    def _send(self, body):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/pdf')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def log_message(self, format, *args):
+        pass
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _StandInHandler)
+    server.hits = {}
+    server.url = f"http://127.0.0.1:{server.server_address[1]}"
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+@pytest.fixture
+def downloader():
+    downloader = extractor_module.AttachmentDownloader(read_timeout=0.2, max_retries=2, retry_delay=0.01,
+                                                       chunk_size=4096)
+    yield downloader
+    downloader.close()
+
+def test_downloads_the_whole_body(server, downloader):
+    assert downloader.download(f"{server.url}/ok") == PDF
+    assert downloader.metrics.get('download.count') == 1
+    assert downloader.metrics.get('download.bytes') == len(PDF)
+
+def test_retries_server_errors(server, downloader):
+    assert downloader.download(f"{server.url}/flaky") == PDF
+    assert server.hits['/flaky'] == 3
+    assert downloader.metrics.get('download.retries') == 2
+
+def test_retries_read_timeouts(server, downloader):
+    assert downloader.download(f"{server.url}/slow") == PDF
+    assert downloader.metrics.get('download.timeouts') == 1
+
+def test_expired_url_is_refreshed_once(server, downloader):
+    refreshed = []
+    
+    def refresh():
+        refreshed.append(True)
+        return f"{server.url}/ok"
+    
+    assert downloader.download(f"{server.url}/expired", refresh) == PDF
+    assert refreshed == [True]
+    assert downloader.metrics.get('download.url_refreshes') == 1
+
+def test_client_errors_fail_without_retries(server, downloader):
+    assert downloader.download(f"{server.url}/missing") is None
+    assert server.hits['/missing'] == 1
+    assert downloader.metrics.get('download.errors') == 1
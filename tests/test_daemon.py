@@ -0,0 +1,35 @@
+import pytest
+
+from fake_airtable import FakeTable, document_records, fake_extractor
+
+import airtable_pdf_extractor as extractor_module
+
+FIELDS = ('Documento', 'CSV', 'Estado_Procesamiento')
+BROKEN_URL = 'https://fake.airtable/roto.pdf'
+
+@pytest.mark.parametrize('pipelined', [False, True])
+def test_failed_attachments_are_not_retried_until_they_change(pipelined, tmp_path):
+    records, pdfs = document_records(3)
+    records[1]['fields']['Documento'][0]['url'] = BROKEN_URL
+    table = FakeTable(records)
+    extractor = fake_extractor(table, pdfs, checkpoint=extractor_module.SyncCheckpoint(str(tmp_path / 'ck.json')))
+    daemon = extractor_module.ExtractorDaemon(extractor, *FIELDS, pipelined=pipelined,
+                                              pipeline_options={'cpu_workers': 1})
+    daemon.start(port=None)
+    try:
+        first = daemon.run_once()
+        second = daemon.run_once()
+        assert (first['success'], first['error']) == (2, 1)
+        assert (second['success'], second['error']) == (0, 0)
+        assert extractor.downloader.requests[BROKEN_URL] == 1
+        assert daemon.status()['failed_attachments'] == 1
+        
+        # A new attachment is processed again
+        new_url = 'https://fake.airtable/nuevo.pdf'
+        pdfs[new_url] = pdfs[records[0]['fields']['Documento'][0]['url']]
+        table.records['rec001']['fields']['Documento'] = [{'id': 'att1b', 'url': new_url, 'filename': 'nuevo.pdf'}]
+        third = daemon.run_once()
+        assert third['success'] == 1
+        assert table.records['rec001']['fields']['Estado_Procesamiento'] == 'Procesado'
+    finally:
+        daemon.close()
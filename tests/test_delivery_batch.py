@@ -0,0 +1,44 @@
+import io
+
+import pytest
+
+import airtable_pdf_extractor as extractor_module
+
+RECORDS = [
+    {'fecha': '04-Sep.-25', 'transac_nr': '812233', 'remito': '70012', 'viaje_nr': '5120', 'chofer': 'PEREZ',
+     'localidad_entrega': 'SAN MIGUEL', 'cliente_codigo': '2210', 'cliente_nombre': 'DISTRIBUIDORA DEL SUR SRL',
+     'bultos': '007', 'cantidad': 120.0, 'peso_neto': 1850.4, 'peso_bruto': 1902.1},
+    {'fecha': '05-Sep.-25', 'transac_nr': '812240', 'remito': '70020', 'viaje_nr': '5121', 'chofer': 'PEREZ',
+     'localidad_entrega': 'LA PLATA', 'cliente_codigo': '2210', 'cliente_nombre': 'DISTRIBUIDORA DEL SUR SRL',
+     'bultos': 'S/D', 'cantidad': 1.0, 'peso_neto': 12.0, 'peso_bruto': 12.5},
+]
+
+def csv_bultos(csv_text):
+    return [line.split(',')[9] for line in csv_text.splitlines()[1:]]
+
+def test_bultos_are_written_as_read():
+    extractor = extractor_module.ImprovedPDFExtractor('key', 'appFake', 'Documentos')
+    csv_text = extractor.convert_to_csv_string(RECORDS)
+    assert csv_bultos(csv_text) == ['007', 'S/D']
+    
+    batch = extractor_module.DeliveryBatch.from_csv(csv_text)
+    assert [record['bultos'] for record in batch] == ['007', 'S/D']
+    output = io.StringIO()
+    batch.write_csv(output)
+    assert output.getvalue() == csv_text
+
+def test_bultos_survive_the_cache_format():
+    batch = extractor_module.DeliveryBatch.from_records(RECORDS)
+    assert [record['bultos'] for record in extractor_module.DeliveryBatch.from_json(batch.to_json())] == ['007', 'S/D']
+
+def test_bultos_are_numbers_in_dataframes():
+    df = extractor_module.DeliveryBatch.from_records(RECORDS).to_dataframe()
+    assert str(df['bultos'].dtype) == 'Int64'
+    assert df['bultos'].iloc[0] == 7
+    assert df['bultos'].isna().iloc[1]
+
+def test_bultos_are_numbers_in_arrow_tables():
+    pytest.importorskip('pyarrow')
+    table = extractor_module.DeliveryBatch.from_records(RECORDS).to_arrow()
+    assert str(table.schema.field('bultos').type) == 'int64'
+    assert table.column('bultos').to_pylist() == [7, None]
@@ -0,0 +1,25 @@
+import airtable_pdf_extractor as extractor_module
+
+KEYS = [(str(70000 + i), str(812000 + i)) for i in range(200)]
+
+def test_saved_filter_is_reused(tmp_path):
+    path = str(tmp_path / 'index.sqlite')
+    index = extractor_module.DeliveryIndex(path, capacity=1000)
+    index.check('rec1', 'a.pdf', KEYS)
+    index.save()
+    
+    reopened = extractor_module.DeliveryIndex(path, capacity=1000)
+    assert reopened.bloom.bits == index.bloom.bits
+    assert reopened.check('rec2', 'b.pdf', KEYS[:10]) == [(*key, 'rec1', 'a.pdf') for key in KEYS[:10]]
+
+def test_filter_saved_with_another_error_rate_is_rebuilt(tmp_path):
+    path = str(tmp_path / 'index.sqlite')
+    index = extractor_module.DeliveryIndex(path, capacity=1000, error_rate=0.05)
+    index.check('rec1', 'a.pdf', KEYS)
+    index.save()
+    
+    reopened = extractor_module.DeliveryIndex(path, capacity=1000, error_rate=0.001)
+    assert reopened.bloom.error_rate == 0.001
+    assert len(reopened.bloom.bits) == (reopened.bloom.size + 7) // 8
+    assert all(reopened._bloom_key(*key) in reopened.bloom for key in KEYS)
+    assert reopened.check('rec2', 'b.pdf', KEYS[:10]) == [(*key, 'rec1', 'a.pdf') for key in KEYS[:10]]
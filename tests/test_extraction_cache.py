@@ -0,0 +1,37 @@
+import os
+
+from fake_airtable import FakeTable, document_records, fake_extractor
+
+import airtable_pdf_extractor as extractor_module
+
+FIELDS = ('Documento', 'CSV', 'Estado_Procesamiento')
+
+def cache_dir_bytes(path):
+    return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+
+def test_worker_processes_respect_the_cache_size_limit(tmp_path):
+    records, pdfs = document_records(8, rows_per_page=60)
+    probe_dir = tmp_path / 'probe'
+    fake_extractor(FakeTable(records[:1]), pdfs,
+                   cache=extractor_module.PDFExtractionCache(str(probe_dir))).process_all_records(*FIELDS)
+    entry_bytes = cache_dir_bytes(probe_dir)
+    
+    cache_dir = str(tmp_path / 'cache')
+    cache = extractor_module.PDFExtractionCache(cache_dir, max_bytes=int(entry_bytes * 2.5))
+    extractor = fake_extractor(FakeTable(records), pdfs, cache=cache)
+    result = extractor.process_all_records_pipelined(*FIELDS, io_workers=4, cpu_workers=2)
+    
+    assert result['success'] == 8
+    assert cache_dir_bytes(cache_dir) <= cache.max_bytes
+    assert cache.total_bytes == cache_dir_bytes(cache_dir)
+    assert cache.misses == 8
+
+def test_pipelined_hits_are_served_by_the_parent(tmp_path):
+    records, pdfs = document_records(3)
+    cache = extractor_module.PDFExtractionCache(str(tmp_path / 'cache'))
+    fake_extractor(FakeTable(records), pdfs, cache=cache).process_all_records_pipelined(*FIELDS, cpu_workers=1)
+    
+    extractor = fake_extractor(FakeTable(records), pdfs, cache=cache)
+    result = extractor.process_all_records_pipelined(*FIELDS, cpu_workers=1)
+    assert result['success'] == 3
+    assert (cache.hits, cache.misses) == (3, 3)
@@ -0,0 +1,45 @@
+import pytest
+
+from benchmark_extractor import CLIENTES, generate_report_pages, report_pages_pdf
+
+import airtable_pdf_extractor as extractor_module
+
+def report_pdf(header_rows, pages=6, rows_per_page=10):
+    """Synthetic report whose page i has a client header before each row index in header_rows[i]"""
+    report = []
+    for page_number, lines in enumerate(generate_report_pages(pages, rows_per_page, seed=3)):
+        rows = [line for line in lines[2:-1] if line.split(' ', 1)[-1] not in CLIENTES]
+        page = lines[:2]
+        for index, row in enumerate(rows):
+            if index in header_rows.get(page_number, ()):
+                page.append(f"{1000 + 10 * page_number + index} {CLIENTES[(page_number + index) % len(CLIENTES)]}")
+            page.append(row)
+        page.append(lines[-1])
+        report.append(page)
+    return report_pages_pdf(report)
+
+# 6 pages in 3 ranges: pages 0-1, 2-3 and 4-5
+REPORTS = {
+    # Ranges 2 and 3 start with rows of the client of the previous range
+    'range_starts_mid_client': {0: [0, 5], 1: [4], 2: [3], 4: [6], 5: [2]},
+    # Range 2 has no client header: all its rows belong to the last client of range 1
+    'range_without_header': {0: [0, 4], 1: [7], 4: [5]},
+}
+
+@pytest.mark.parametrize('name', sorted(REPORTS))
+def test_page_ranges_match_a_sequential_parse(name):
+    pdf_content = report_pdf(REPORTS[name])
+    sequential = extractor_module.ImprovedPDFExtractor('key', 'appFake', 'Documentos')
+    parallel = extractor_module.ImprovedPDFExtractor('key', 'appFake', 'Documentos',
+                                                     page_parallel_threshold=2, page_workers=3)
+    try:
+        expected, expected_batch = sequential.process_pdf(pdf_content)
+        output, batch = parallel.process_pdf(pdf_content)
+    finally:
+        parallel._close_page_pool()
+    
+    assert parallel.metrics.get('extract.page_ranges') == 3
+    assert len(expected_batch) == 60
+    assert output == expected
+    assert list(batch) == list(expected_batch)
+    assert all(row['cliente_nombre'] for row in batch)
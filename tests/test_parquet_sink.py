@@ -0,0 +1,59 @@
+import os
+
+import pytest
+
+from benchmark_extractor import generate_report_pdf
+from fake_airtable import FakeTable, document_records, fake_extractor
+
+import airtable_pdf_extractor as extractor_module
+
+pa = pytest.importorskip('pyarrow')
+pq = pytest.importorskip('pyarrow.parquet')
+
+FIELDS = ('Documento', 'CSV', 'Estado_Procesamiento')
+
+def reprocess(table, pdfs, sink):
+    for record in table.records.values():
+        record['fields']['Estado_Procesamiento'] = 'Pendiente'
+    return fake_extractor(table, pdfs, parquet_sink=sink).process_all_records(*FIELDS)
+
+def document_months(sink, record_id):
+    return {partition[len('mes='):] for partition in sink.document_files(record_id)}
+
+def test_dataset_is_typed_and_idempotent_on_reprocessing(tmp_path):
+    records, pdfs = document_records(3, rows_per_page=30)
+    table = FakeTable(records)
+    sink = extractor_module.ParquetDeliverySink(str(tmp_path / 'entregas'))
+    fake_extractor(table, pdfs, parquet_sink=sink).process_all_records(*FIELDS)
+    
+    dataset = pq.read_table(sink.root)
+    assert dataset.num_rows == 90
+    assert dataset.schema.field('fecha').type == pa.date32()
+    assert dataset.schema.field('bultos').type == pa.int64()
+    assert dataset.schema.field('record_id').type == pa.string()
+    assert set(dataset['record_id'].to_pylist()) == {'rec000', 'rec001', 'rec002'}
+    
+    reprocess(table, pdfs, sink)
+    assert pq.read_table(sink.root).num_rows == 90
+    
+    fake_extractor(table, pdfs, parquet_sink=sink).rebuild_parquet_dataset(*FIELDS)
+    assert pq.read_table(sink.root).num_rows == 90
+
+def test_reprocessed_document_drops_its_stale_month_partitions(tmp_path):
+    records, pdfs = document_records(3, rows_per_page=30)
+    table = FakeTable(records)
+    sink = extractor_module.ParquetDeliverySink(str(tmp_path / 'entregas'))
+    fake_extractor(table, pdfs, parquet_sink=sink).process_all_records(*FIELDS)
+    old_months = document_months(sink, 'rec000')
+    
+    # The same attachment now holds a shorter report with other dates
+    pdfs[records[0]['fields']['Documento'][0]['url']] = generate_report_pdf(1, rows_per_page=5, seed=41)
+    reprocess(table, pdfs, sink)
+    
+    new_rows = pq.read_table(sink.root, filters=[('record_id', '=', 'rec000')])
+    new_months = {fecha.strftime('%Y-%m') for fecha in new_rows['fecha'].to_pylist()}
+    assert old_months - new_months  # the test needs a month that disappears
+    assert document_months(sink, 'rec000') == new_months
+    assert new_rows.num_rows == 5
+    assert pq.read_table(sink.root).num_rows == 65
+    assert not [name for _, _, names in os.walk(sink.root) for name in names if name.endswith('.tmp')]
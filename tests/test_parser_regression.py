@@ -0,0 +1,7 @@
+import pytest
+
+from benchmark_extractor import check_corpus
+
+@pytest.mark.parametrize('result', check_corpus(repeat=1), ids=lambda result: result['name'])
+def test_parser_output_matches_the_regression_corpus(result):
+    assert result['mismatch'] is None
@@ -0,0 +1,123 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from fake_airtable import FakeTable, document_records, fake_extractor
+
+import airtable_pdf_extractor as extractor_module
+
+FIELDS = ('Documento', 'CSV', 'Estado_Procesamiento')
+
+def lease_value(minutes, owner):
+    expiry = datetime.now(timezone.utc) + timedelta(minutes=minutes)
+    return f"{expiry.isoformat(timespec='seconds')} ({owner})"
+
+@pytest.mark.parametrize('pipelined', [False, True])
+def test_shards_process_each_record_once(pipelined):
+    records, pdfs = document_records(12)
+    table = FakeTable(records)
+    for shard_index in range(3):
+        extractor = fake_extractor(table, pdfs, shard_index=shard_index, shard_count=3, lease_seconds=60)
+        extractor.process_pending_records(*FIELDS, pipelined=pipelined, io_workers=2, cpu_workers=1)
+    
+    assert all(record['fields']['Estado_Procesamiento'] == 'Procesado' for record in table.records.values())
+    assert set(table.status_writes.values()) == {1}
+    assert not any('Lease_Procesamiento' in record['fields'] for record in table.records.values())
+
+def test_live_leases_of_other_workers_are_skipped():
+    records, pdfs = document_records(3)
+    records[0]['fields']['Lease_Procesamiento'] = lease_value(5, 'otro-worker')
+    records[1]['fields']['Lease_Procesamiento'] = lease_value(-5, 'worker-caido')
+    table = FakeTable(records)
+    extractor = fake_extractor(table, pdfs, lease_seconds=60)
+    result = extractor.process_pending_records(*FIELDS, pipelined=False)
+    
+    assert result['success'] == 2
+    assert table.records['rec000']['fields']['Estado_Procesamiento'] == 'Pendiente'
+    assert table.records['rec000']['fields']['Lease_Procesamiento'].endswith('(otro-worker)')
+    assert table.records['rec001']['fields']['Estado_Procesamiento'] == 'Procesado'
+    assert 'Lease_Procesamiento' not in table.records['rec001']['fields']
+
+def test_leases_do_not_touch_the_status_field(tmp_path):
+    records, pdfs = document_records(3)
+    records[1]['fields']['Estado_Procesamiento'] = 'Error'
+    records[2]['fields']['Documento'][0]['url'] = 'https://fake.airtable/roto.pdf'
+    table = FakeTable(records)
+    checkpoint = extractor_module.SyncCheckpoint(str(tmp_path / 'checkpoint.json'))
+    checkpoint.mark('rec001', 'att1')
+    extractor = fake_extractor(table, pdfs, checkpoint=checkpoint, lease_seconds=60)
+    extractor.process_all_records(*FIELDS)
+    
+    statuses = {record_id: record['fields']['Estado_Procesamiento'] for record_id, record in table.records.items()}
+    assert statuses == {'rec000': 'Procesado', 'rec001': 'Error', 'rec002': 'Error'}
+    assert not any('Lease_Procesamiento' in record['fields'] for record in table.records.values())
+    assert not extractor.leases_held
+
+def test_claim_keeps_only_the_records_whose_lease_was_read_back():
+    records, _ = document_records(2)
+    table = FakeTable(records)
+    leases = extractor_module.RecordLeases(table, 'Estado_Procesamiento', 'Lease_Procesamiento', 'worker-a',
+                                           settle_seconds=0)
+    original = table.batch_update
+    
+    def overwritten_by_another_worker(updates):
+        original(updates)
+        original([{'id': 'rec001', 'fields': {'Lease_Procesamiento': lease_value(15, 'worker-b')}}])
+    
+    table.batch_update = overwritten_by_another_worker
+    claimed = leases.claim(list(table.records.values()))
+    assert [record['id'] for record in claimed] == ['rec000']
+    assert leases.metrics.get('lease.lost') == 1
+
+def fail_lease_writes(table, record_id, times=None):
+    """Make the lease writes of the chunk holding record_id fail (times times, or always)"""
+    original = table.batch_update
+    failures = []
+    
+    def batch_update(updates):
+        leasing = any('Lease_Procesamiento' in update['fields'] and update['fields']['Lease_Procesamiento']
+                      for update in updates)
+        if leasing and any(update['id'] == record_id for update in updates) and (times is None or len(failures) < times):
+            failures.append(updates)
+            raise RuntimeError("422 Unprocessable Entity")
+        original(updates)
+    
+    table.batch_update = batch_update
+    return failures
+
+def test_a_chunk_that_cannot_be_claimed_is_left_for_the_next_run(monkeypatch):
+    monkeypatch.setattr(extractor_module.time, 'sleep', lambda seconds: None)
+    records, pdfs = document_records(25)
+    table = FakeTable(records)
+    failures = fail_lease_writes(table, 'rec010')
+    extractor = fake_extractor(table, pdfs, lease_seconds=60)
+    result = extractor.process_pending_records(*FIELDS, pipelined=False)
+    
+    assert (result['success'], result['error']) == (15, 0)
+    assert len(failures) == 4  # First attempt and 3 retries
+    assert extractor.metrics.get('lease.failed') == 10
+    statuses = [record['fields']['Estado_Procesamiento'] for record in table.records.values()]
+    assert statuses == ['Procesado'] * 10 + ['Pendiente'] * 10 + ['Procesado'] * 5
+    assert not any('Lease_Procesamiento' in record['fields'] for record in table.records.values())
+
+def test_lease_calls_are_retried(monkeypatch):
+    monkeypatch.setattr(extractor_module.time, 'sleep', lambda seconds: None)
+    records, pdfs = document_records(25)
+    table = FakeTable(records)
+    fail_lease_writes(table, 'rec010', times=1)
+    original = table.all
+    read_failures = []
+    
+    def all(formula=None, fields=None):
+        if 'RECORD_ID()' in formula and not read_failures:
+            read_failures.append(formula)
+            raise RuntimeError("503 Service Unavailable")
+        return original(formula=formula, fields=fields)
+    
+    table.all = all
+    extractor = fake_extractor(table, pdfs, lease_seconds=60)
+    result = extractor.process_pending_records(*FIELDS, pipelined=True, io_workers=2, cpu_workers=1)
+    
+    assert (result['success'], result['error']) == (25, 0)
+    assert extractor.metrics.get('airtable.retries') == 2
+    assert not extractor.metrics.get('lease.failed')
@@ -0,0 +1,78 @@
+import json
+
+from fake_airtable import FakeTable, document_records, fake_extractor
+
+import airtable_pdf_extractor as extractor_module
+
+FIELDS = ('Documento', 'CSV', 'Estado_Procesamiento')
+
+def test_rollups_pass_only_fetches_the_csv_changed_since_the_previous_one(tmp_path):
+    records, pdfs = document_records(4)
+    table = FakeTable(records)
+    fake_extractor(table, pdfs).process_all_records(*FIELDS)
+    
+    def rollups_pass():
+        extractor = fake_extractor(table, pdfs,
+                                   rollups=extractor_module.ClientRollups(str(tmp_path / 'rollups.json')),
+                                   delivery_index=extractor_module.DeliveryIndex(str(tmp_path / 'index.sqlite')))
+        table.formulas.clear()
+        extractor.sync_stored_documents(*FIELDS)
+        return extractor
+    
+    first = rollups_pass()
+    assert table.formulas == ["{Estado_Procesamiento} = 'Procesado'"]
+    assert first.rollups.synced_at is not None
+    assert first.delivery_index.synced_at == first.rollups.synced_at
+    clients = first.rollups.clients
+    deliveries = len(first.delivery_index)
+    
+    second = rollups_pass()
+    assert len(table.formulas) == 1
+    assert "IS_AFTER(LAST_MODIFIED_TIME({CSV})" in table.formulas[0]
+    # Applying the same documents again changes neither store
+    assert second.rollups.clients == clients
+    assert len(second.delivery_index) == deliveries
+    assert not second.duplicates
+
+def test_full_pass_only_upserts_clients_whose_summary_row_changed(tmp_path):
+    records, pdfs = document_records(3)
+    table = FakeTable(records)
+    fake_extractor(table, pdfs).process_all_records(*FIELDS)
+    summary_table = FakeTable()
+    
+    def seed(path):
+        extractor = fake_extractor(table, pdfs, rollups=extractor_module.ClientRollups(str(path)),
+                                   summary_table_name='Totales')
+        extractor.summary_table = summary_table
+        extractor.sync_stored_documents(*FIELDS)
+        return extractor
+    
+    first = seed(tmp_path / 'rollups.json')
+    assert len(summary_table.records) == len(first.rollups.clients)
+    
+    # A lost state file is rebuilt from every CSV, but the summary rows are already up to date
+    second = seed(tmp_path / 'otro.json')
+    assert second.metrics.get('airtable.summary_upserts') == 0
+    assert summary_table.calls['batch_upsert'] == 1
+
+def test_rollups_pass_writes_the_duplicates_to_the_run_summary(tmp_path):
+    records, pdfs = document_records(3)
+    records[2]['fields']['Documento'][0]['url'] = records[0]['fields']['Documento'][0]['url']
+    table = FakeTable(records)
+    fake_extractor(table, pdfs).process_all_records(*FIELDS)
+    
+    summary_path = tmp_path / 'run_summary.json'
+    extractor = fake_extractor(table, pdfs, summary_path=str(summary_path),
+                               delivery_index=extractor_module.DeliveryIndex(str(tmp_path / 'index.sqlite')))
+    extractor.sync_stored_documents(*FIELDS)
+    
+    summary = json.loads(summary_path.read_text(encoding='utf-8'))
+    assert summary['stored_documents']['documents'] == 3
+    assert summary['duplicates'] == {'rec002': {'documento': 'reporte2.pdf', 'duplicados': 12,
+                                                'primera_vez_en': {'reporte0.pdf': 12}}}
+    
+    # The next run's summary keeps the pass, duplicates included
+    extractor.process_all_records(*FIELDS)
+    summary = json.loads(summary_path.read_text(encoding='utf-8'))
+    assert summary['records']['skipped'] == 3
+    assert list(summary['stored_documents']['duplicates']) == ['rec002']
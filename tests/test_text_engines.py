@@ -0,0 +1,68 @@
+from benchmark_extractor import generate_report_pdf
+
+import airtable_pdf_extractor as extractor_module
+
+class StubEngine:
+    """Fast engine giving pdfplumber's text, except for pages chosen to be garbled, empty or failing"""
+    name = 'stub'
+    
+    def __init__(self, garbled=(), empty=(), failing=(), fail_open=False):
+        self.pdfplumber = extractor_module.PdfplumberEngine()
+        self.garbled = set(garbled)
+        self.empty = set(empty)
+        self.failing = set(failing)
+        self.fail_open = fail_open
+    
+    def load(self):
+        pass
+    
+    def open(self, pdf_content):
+        if self.fail_open:
+            raise RuntimeError("PDF dañado")
+        return self.pdfplumber.open(pdf_content)
+    
+    def page_count(self, document):
+        return self.pdfplumber.page_count(document)
+    
+    def extract_page(self, document, index):
+        if index in self.failing:
+            raise RuntimeError("error de decodificación")
+        if index in self.empty:
+            return ""
+        page_text = self.pdfplumber.extract_page(document, index)
+        # Columns run together, as fast engines do on some layouts
+        return page_text.replace(' ', '') if index in self.garbled else page_text
+    
+    def close(self, document):
+        self.pdfplumber.close(document)
+
+PDF_CONTENT = generate_report_pdf(6, rows_per_page=15)
+
+def extractor_with(*engines):
+    return extractor_module.ImprovedPDFExtractor('key', 'appFake', 'Documentos', engines=list(engines))
+
+def test_garbled_pages_fail_the_delivery_line_check():
+    stub = StubEngine(garbled=[1])
+    document = stub.open(PDF_CONTENT)
+    assert extractor_module.page_has_delivery_lines(stub.extract_page(document, 0))
+    assert not extractor_module.page_has_delivery_lines(stub.extract_page(document, 1))
+    stub.close(document)
+
+def test_rejected_pages_are_extracted_again_by_the_last_engine():
+    expected = extractor_with(extractor_module.PdfplumberEngine())
+    extractor = extractor_with(StubEngine(garbled=[1], empty=[3], failing=[4]), extractor_module.PdfplumberEngine())
+    
+    assert extractor.extract_text_from_pdf(PDF_CONTENT) == expected.extract_text_from_pdf(PDF_CONTENT)
+    assert extractor.process_pdf_content(PDF_CONTENT) == expected.process_pdf_content(PDF_CONTENT)
+    extract = extractor.metrics.to_dict()['extract']
+    # Counted once per pass: extract_text_from_pdf and process_pdf_content
+    assert (extract['pages_stub'], extract['pages_pdfplumber'], extract['fallback_pages']) == (6, 6, 6)
+
+def test_engine_that_cannot_open_the_pdf_degrades_to_pdfplumber():
+    expected = extractor_with(extractor_module.PdfplumberEngine())
+    extractor = extractor_with(StubEngine(fail_open=True), extractor_module.PdfplumberEngine())
+    
+    assert extractor.process_pdf_content(PDF_CONTENT) == expected.process_pdf_content(PDF_CONTENT)
+    extract = extractor.metrics.to_dict()['extract']
+    assert (extract['pages_pdfplumber'], extract.get('fallback_pages', 0)) == (6, 0)
+    assert 'pages_stub' not in extract
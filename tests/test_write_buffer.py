@@ -0,0 +1,48 @@
+import pytest
+
+from fake_airtable import FakeTable, document_records, fake_extractor
+
+import airtable_pdf_extractor as extractor_module
+
+FIELDS = ('Documento', 'CSV', 'Estado_Procesamiento')
+
+@pytest.mark.parametrize('pipelined', [False, True])
+def test_records_whose_update_fails_are_counted_as_errors(tmp_path, monkeypatch, pipelined):
+    monkeypatch.setattr(extractor_module.time, 'sleep', lambda seconds: None)
+    records, pdfs = document_records(5)
+    table = FakeTable(records)
+    
+    def unavailable(updates):
+        table.calls['batch_update'] += 1
+        raise RuntimeError("503 Service Unavailable")
+    
+    table.batch_update = unavailable
+    checkpoint_path = str(tmp_path / 'checkpoint.json')
+    checkpoint = extractor_module.SyncCheckpoint(checkpoint_path)
+    checkpoint.mark('rec999', 'att999')
+    checkpoint.save()
+    extractor = fake_extractor(table, pdfs, checkpoint=checkpoint)
+    result = extractor.process_pending_records(*FIELDS, pipelined=pipelined, io_workers=2, cpu_workers=1)
+    
+    assert (result['success'], result['error'], result['failed_writes']) == (0, 5, 5)
+    assert table.calls['batch_update'] == 4  # First attempt and 3 retries
+    assert all(record['fields']['Estado_Procesamiento'] == 'Pendiente' for record in table.records.values())
+    assert extractor_module.SyncCheckpoint(checkpoint_path).is_done('rec999', 'att999')
+
+def test_only_the_records_of_the_failed_chunk_are_counted_as_errors(monkeypatch):
+    monkeypatch.setattr(extractor_module.time, 'sleep', lambda seconds: None)
+    records, pdfs = document_records(12)
+    table = FakeTable(records)
+    original = table.batch_update
+    
+    def second_chunk_rejected(updates):
+        if any(update['id'] == 'rec011' for update in updates):
+            raise RuntimeError("422 Unprocessable Entity")
+        original(updates)
+    
+    table.batch_update = second_chunk_rejected
+    result = fake_extractor(table, pdfs).process_all_records(*FIELDS)
+    
+    assert (result['success'], result['error'], result['failed_writes']) == (10, 2, 2)
+    statuses = [record['fields']['Estado_Procesamiento'] for record in table.records.values()]
+    assert statuses == ['Procesado'] * 10 + ['Pendiente'] * 2